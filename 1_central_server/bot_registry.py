@@ -0,0 +1,157 @@
+import threading
+from datetime import datetime
+from timed_lock import TimedLock
+
+class BotRecord:
+    # One bot. __slots__ keeps thousands of records compact; only mutated under its shard lock.
+    __slots__ = ('status', 'games_completed', 'last_heartbeat', 'progress', 'idle_seconds', 'busy_seconds', 'fps')
+
+    def __init__(self, status='idle', games_completed=0, last_heartbeat=None, progress=0.0,
+                 idle_seconds=0.0, busy_seconds=0.0, fps=None):
+        self.status = status
+        self.games_completed = games_completed
+        self.last_heartbeat = last_heartbeat or datetime.now()
+        self.progress = progress
+        self.idle_seconds = idle_seconds
+        self.busy_seconds = busy_seconds
+        self.fps = fps  # Steps/s of its last game
+
+    def to_dict(self):
+        # Journal/snapshot/UI form (same keys as the old per-bot dicts)
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields['last_heartbeat'] = self.last_heartbeat.isoformat()
+        return fields
+
+    @classmethod
+    def from_dict(cls, fields):
+        fields = {k: v for k, v in fields.items() if k in cls.__slots__}
+        hb = fields.get('last_heartbeat')
+        fields['last_heartbeat'] = datetime.fromisoformat(hb) if isinstance(hb, str) else None
+        return cls(**fields)
+
+class BotRegistry:
+    # Bots split over lock shards by hash(bot_id): heartbeats from different bots never contend
+    # on one lock. Fleet aggregates (active/crashed, games, busy/idle time) are kept up to date
+    # on every transition, so readers get them in O(1) instead of scanning all bots.
+    # on_change(bot_id, record) is called under the shard lock after each mutation (journaling).
+    def __init__(self, shards=16, on_change=None):
+        self.shards = [({}, TimedLock('bot_shard', threading.Lock())) for _ in range(shards)]
+        self.on_change = on_change
+        self.agg_lock = threading.Lock()
+        self.count = 0
+        self.crashed = 0
+        self.games_total = 0
+        self.idle_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def _shard(self, bot_id):
+        return self.shards[hash(bot_id) % len(self.shards)]
+
+    def _add_aggregates(self, count=0, crashed=0, games=0, idle=0.0, busy=0.0):
+        with self.agg_lock:
+            self.count += count
+            self.crashed += crashed
+            self.games_total += games
+            self.idle_seconds += idle
+            self.busy_seconds += busy
+
+    @property
+    def active(self):
+        return self.count - self.crashed
+
+    def idle_fraction(self):
+        total = self.idle_seconds + self.busy_seconds
+        return self.idle_seconds / total if total else None
+
+    def register(self, bot_id):
+        # True if the bot is new
+        bots, lock = self._shard(bot_id)
+        if bot_id in bots:  # Lock-free fast path (dict lookups are atomic)
+            return False
+        with lock:
+            if bot_id in bots:
+                return False
+            record = bots[bot_id] = BotRecord()
+            self._add_aggregates(count=1)
+            if self.on_change:
+                self.on_change(bot_id, record)
+            return True
+
+    def heartbeat(self, bot_id, status, progress, max_gap):
+        # Time since the last heartbeat counts as busy/idle by the status that bot reported then
+        self.register(bot_id)
+        bots, lock = self._shard(bot_id)
+        with lock:
+            record = bots[bot_id]
+            now = datetime.now()
+            elapsed = min((now - record.last_heartbeat).total_seconds(), max_gap)
+            if record.status == 'playing':
+                record.busy_seconds += elapsed
+                self._add_aggregates(busy=elapsed)
+            elif record.status != 'crashed':
+                record.idle_seconds += elapsed
+                self._add_aggregates(idle=elapsed)
+            self._set_status(record, status)
+            record.progress = progress
+            record.last_heartbeat = now
+            if self.on_change:
+                self.on_change(bot_id, record)
+            return record
+
+    def set_status(self, bot_id, status):
+        bots, lock = self._shard(bot_id)
+        with lock:
+            record = bots.get(bot_id)
+            if record is None or record.status == status:
+                return None
+            self._set_status(record, status)
+            if self.on_change:
+                self.on_change(bot_id, record)
+            return record
+
+    def _set_status(self, record, status):
+        was_crashed, is_crashed = record.status == 'crashed', status == 'crashed'
+        if was_crashed != is_crashed:
+            self._add_aggregates(crashed=1 if is_crashed else -1)
+        record.status = status
+
+    def game_completed(self, bot_id, fps=None):
+        bots, lock = self._shard(bot_id)
+        with lock:
+            record = bots.get(bot_id)
+            if record is None:
+                return
+            record.games_completed += 1
+            if fps is not None:
+                record.fps = fps
+            self._add_aggregates(games=1)
+            if self.on_change:
+                self.on_change(bot_id, record)
+
+    def get(self, bot_id):
+        bots, _ = self._shard(bot_id)
+        return bots.get(bot_id)
+
+    def load(self, bot_id, fields):
+        # Restore (journal replay) - replaces the record and its share of the aggregates
+        record = BotRecord.from_dict(fields)
+        bots, lock = self._shard(bot_id)
+        with lock:
+            old = bots.get(bot_id)
+            if old is not None:
+                self._add_aggregates(count=-1, crashed=-(old.status == 'crashed'), games=-old.games_completed,
+                                     idle=-old.idle_seconds, busy=-old.busy_seconds)
+            bots[bot_id] = record
+            self._add_aggregates(count=1, crashed=int(record.status == 'crashed'), games=record.games_completed,
+                                 idle=record.idle_seconds, busy=record.busy_seconds)
+
+    def items(self):
+        # Consistent per-shard copies: [(bot_id, dict)]
+        result = []
+        for bots, lock in self.shards:
+            with lock:
+                result.extend((bot_id, record.to_dict()) for bot_id, record in bots.items())
+        return result
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,33 @@
+import time
+import threading
+from collections import deque
+
+class EventRing:
+    # Bounded in-memory event log for the dashboard: the last `capacity` events with
+    # increasing sequence numbers. Readers ask for everything after the last seq they saw
+    # (JSON feed) or block until something new arrives (SSE feed). add() matches the
+    # ServerState.event_listeners signature.
+    def __init__(self, capacity=500):
+        self.events = deque(maxlen=capacity)
+        self.cond = threading.Condition()
+        self.seq = 0
+
+    def add(self, kind, fields):
+        with self.cond:
+            self.seq += 1
+            self.events.append(dict(fields, seq=self.seq, time=time.time(), kind=kind))
+            self.cond.notify_all()
+
+    def since(self, seq=0, limit=None):
+        # Events newer than seq, oldest first (older ones may have been overwritten)
+        with self.cond:
+            if seq >= self.seq:
+                return []
+            new = [e for e in self.events if e['seq'] > seq]
+        return new[-limit:] if limit else new
+
+    def wait(self, seq, timeout):
+        # Blocks until there is an event newer than seq or timeout passes
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > seq, timeout)
+        return self.since(seq)
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import threading
+import logging
+import trajectory_codec
+
+class GameStore:
+    # Spill-to-disk buffer for completed games. Each game body is appended once to the
+    # active segment file (segment_NNNNNN.dat) and a small index line to its .idx sidecar;
+    # ServerState.games_buffer only holds the index entries. A batch is assembled by
+    # copying byte ranges out of the segments - no re-serializing. JSON-only batches stay a
+    # JSON array; batches containing binary games use the trajectory_codec CRB1 framing.
+    def __init__(self, directory, segment_max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.lock = threading.Lock()
+        self.released = set()  # {(segment, offset)} handed off to training
+        self.segment_entries = {}  # {segment: count of indexed games}
+        os.makedirs(directory, exist_ok=True)
+        self.active_segment = self._next_segment_id()
+
+    def _path(self, segment, ext):
+        return os.path.join(self.directory, f"segment_{segment:06d}.{ext}")
+
+    def _segments(self):
+        ids = []
+        for name in os.listdir(self.directory):
+            if name.startswith('segment_') and name.endswith('.dat'):
+                ids.append(int(name[len('segment_'):-len('.dat')]))
+        return sorted(ids)
+
+    def _next_segment_id(self):
+        segments = self._segments()
+        return segments[-1] + 1 if segments else 1
+
+    def append(self, raw_body, game_data, fmt='json'):
+        # raw_body: the game exactly as received (JSON or trajectory_codec binary), as bytes or
+        # an iterable of byte pieces (a sealed streaming upload, written without joining it);
+        # game_data: its parsed form or binary header metadata - only totals are read
+        trajectory = game_data.get('trajectory', [])
+        entry = {
+            'bot_id': game_data['bot_id'],
+            'steps': game_data.get('total_steps', len(trajectory)),
+            'reward': game_data.get('total_reward', sum(s.get('reward', 0) for s in trajectory)),
+            'timestamp': game_data.get('timestamp'),
+            'model_version': (game_data.get('game_metadata') or {}).get('model_version'),  # Policy that played it
+            'fmt': fmt
+        }
+        if shutil.disk_usage(self.directory).free < 1024 ** 3:
+            logging.warning("Game store: less than 1GB disk free")
+        with self.lock:
+            data_path = self._path(self.active_segment, 'dat')
+            if os.path.exists(data_path) and os.path.getsize(data_path) >= self.segment_max_bytes:
+                self.active_segment += 1
+                data_path = self._path(self.active_segment, 'dat')
+            with open(data_path, 'ab') as f:
+                offset = f.tell()
+                for piece in ([raw_body] if isinstance(raw_body, (bytes, bytearray)) else raw_body):
+                    f.write(piece)
+                length = f.tell() - offset
+                f.write(b'\n')
+                f.flush()
+                os.fsync(f.fileno())
+            entry.update(segment=self.active_segment, offset=offset, length=length)
+            # Index written after the data is durable: an index line never points at missing bytes
+            with open(self._path(self.active_segment, 'idx'), 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self.segment_entries[self.active_segment] = self.segment_entries.get(self.active_segment, 0) + 1
+        return entry
+
+    def load(self):
+        # Rebuild the buffer index from segment sidecars, minus games already handed off
+        released = set()
+        released_path = os.path.join(self.directory, 'released.log')
+        try:
+            with open(released_path, 'r') as f:
+                for line in f:
+                    try:
+                        segment, offset = json.loads(line)
+                    except (json.JSONDecodeError, ValueError):
+                        continue  # Torn last line
+                    released.add((segment, offset))
+        except FileNotFoundError:
+            pass
+        entries = []
+        segment_entries = {}
+        for segment in self._segments():
+            data_size = os.path.getsize(self._path(segment, 'dat'))
+            count = 0
+            try:
+                with open(self._path(segment, 'idx'), 'r') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except json.JSONDecodeError:
+                            break
+                        if entry['offset'] + entry['length'] > data_size:
+                            logging.warning(f"Segment {segment}: index points past data, truncated game dropped")
+                            break
+                        count += 1
+                        if (segment, entry['offset']) not in released:
+                            entries.append(entry)
+            except FileNotFoundError:
+                logging.warning(f"Segment {segment} has no index, skipped")
+            segment_entries[segment] = count
+        with self.lock:
+            self.released = {r for r in released if r[0] in segment_entries}
+            self.segment_entries = segment_entries
+        logging.info(f"Game store: {len(entries)} buffered games recovered from {len(segment_entries)} segments")
+        return entries
+
+    def read_game(self, entry):
+        with open(self._path(entry['segment'], 'dat'), 'rb') as f:
+            f.seek(entry['offset'])
+            return f.read(entry['length'])
+
+    def write_batch(self, entries, batch_file):
+        # Raw game bodies streamed segment -> batch file
+        framed = any(e.get('fmt', 'json') != 'json' for e in entries)
+        with open(batch_file, 'wb') as out:
+            out.write(trajectory_codec.BATCH_MAGIC if framed else b'[')
+            for i, entry in enumerate(entries):
+                if framed:
+                    out.write(trajectory_codec.BATCH_RECORD.pack(
+                        trajectory_codec.BATCH_FORMATS[entry.get('fmt', 'json')], entry['length']))
+                elif i:
+                    out.write(b',')
+                with open(self._path(entry['segment'], 'dat'), 'rb') as f:
+                    f.seek(entry['offset'])
+                    remaining = entry['length']
+                    while remaining > 0:
+                        chunk = f.read(min(remaining, 1024 * 1024))
+                        if not chunk:
+                            raise IOError(f"Segment {entry['segment']} truncated at offset {entry['offset']}")
+                        out.write(chunk)
+                        remaining -= len(chunk)
+            if not framed:
+                out.write(b']')
+        return batch_file
+
+    def release(self, entries):
+        # Games consumed by a batch: remember it, delete segments whose games are all consumed
+        with self.lock:
+            with open(os.path.join(self.directory, 'released.log'), 'a') as f:
+                for entry in entries:
+                    f.write(json.dumps([entry['segment'], entry['offset']]) + '\n')
+                    self.released.add((entry['segment'], entry['offset']))
+                f.flush()
+                os.fsync(f.fileno())
+            deleted = False
+            for segment, count in list(self.segment_entries.items()):
+                if segment == self.active_segment:
+                    continue
+                done = sum(1 for r in self.released if r[0] == segment)
+                if done >= count:
+                    for ext in ('dat', 'idx'):
+                        try:
+                            os.remove(self._path(segment, ext))
+                        except FileNotFoundError:
+                            pass
+                    del self.segment_entries[segment]
+                    self.released = {r for r in self.released if r[0] != segment}
+                    deleted = True
+                    logging.info(f"Game store: segment {segment} fully consumed, deleted")
+            if deleted:  # Keep released.log proportional to live segments
+                with open(os.path.join(self.directory, 'released.log'), 'w') as f:
+                    f.write(''.join(json.dumps(list(r)) + '\n' for r in sorted(self.released)))
+
+    def disk_usage(self):
+        return sum(os.path.getsize(os.path.join(self.directory, n)) for n in os.listdir(self.directory))
+
+# Edge: Crash mid-append - the .idx line is written after the fsynced data, so a torn game is never indexed.
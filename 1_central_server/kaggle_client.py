@@ -2,27 +2,52 @@ import json
 import requests
 import logging
 import os
+import time
 from datetime import datetime
 
-def send_batch_to_kaggle(games_batch, config):
-    # Phase 4 integration: Save local first
-    batch_file = f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    with open(batch_file, 'w') as f:
-        json.dump(games_batch, f)  # Compressed already in data
-    logging.info(f"Batch saved locally: {batch_file} (size: {os.path.getsize(batch_file)/1024:.1f}KB)")
-    
-    # TODO: Kaggle API (upload dataset, trigger notebook)
-    # kaggle datasets create -p {batch_file} --dir-mode zip  # Compress for space
-    # Then run notebook via API or manual
-    # Download model: kaggle datasets download -d your_model -p models/
-    
+def make_batch_file(game_store, entries, directory='.'):
+    # Batch = concatenated raw game bodies copied out of the segment files (no json.dump)
+    batch_file = os.path.join(directory, f"batch_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.json")
+    return game_store.write_batch(entries, batch_file)
+
+_replay_stores = {}  # One ReplayStore per directory, shared by all training workers
+
+def get_replay_store(config):
+    # None when replay is disabled (replay_max_mb 0)
+    max_mb = config.get('replay_max_mb', 2048)
+    if not max_mb:
+        return None
+    from replay_store import ReplayStore  # From 3_kaggle_training, like train_ppo
+    directory = config.get('replay_dir', 'replay_store')
+    if directory not in _replay_stores:
+        _replay_stores[directory] = ReplayStore(directory, max_mb * 1024 * 1024, config.get('replay_eviction', 'fifo'))
+    return _replay_stores[directory]
+
+def train_local(batch_file, config):
     # Simulate: Call train_ppo.py locally for test
     from train_ppo import train_on_batch  # Import from 3_kaggle_training
-    new_model_path = train_on_batch(batch_file)  # Returns .pth path
-    
-    # Delete batch after (space)
-    os.remove(batch_file)
-    
-    return new_model_path  # For state update
-
-# Edge: If Kaggle down, queue to 'pending_batches/' dir, retry every 5 min thread.
+    # Continues from the published model (the one the bots played with); the output is per job, so
+    # concurrent training_workers can't overwrite each other before _training_done moves it into place
+    return train_on_batch(batch_file, model_path=config['model_save_path'], output_path=batch_file + '.pth',
+                          replay=get_replay_store(config),
+                          replay_ratio=config.get('replay_ratio', 0.5))  # Returns .pth path
+
+def train_simulated(batch_file, config):
+    # Load tests (fleet_simulator): no model, just takes simulated_training_seconds
+    time.sleep(config.get('simulated_training_seconds', 5))
+    model_path = batch_file + '.pth'
+    with open(model_path, 'wb') as f:
+        f.write(os.urandom(64 * 1024))  # Placeholder checkpoint - bots in the simulator never load it
+    return model_path
+
+# Pluggable training backends, selected by config['kaggle_endpoint']. Each takes
+# (batch_file, config), returns the new .pth path and raises on failure (job is retried).
+# A remote (Kaggle API) backend slots in here once it exists.
+BACKENDS = {'local': train_local, 'simulated': train_simulated}
+
+def send_batch_to_kaggle(batch_file, config):
+    logging.info(f"Training on batch: {batch_file} (size: {os.path.getsize(batch_file)/1024:.1f}KB)")
+    backend = BACKENDS[config.get('kaggle_endpoint', 'local')]
+    return backend(batch_file, config)  # For state update; caller deletes the batch on success
+
+# Edge: If the backend fails, the training queue keeps the batch in 'pending_batches/' and retries with backoff.
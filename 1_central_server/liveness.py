@@ -0,0 +1,62 @@
+import time
+import heapq
+import threading
+import logging
+
+class LivenessMonitor:
+    # Heartbeat deadlines in a min-heap with lazy deletion: touch() pushes a new deadline and
+    # supersedes the bot's previous one (generation number), the sweeper thread sleeps until
+    # the earliest deadline and pops only what is due. A sweep costs O(expired * log n) instead
+    # of scanning every bot, and nothing runs while every bot is on time.
+    # on_expired(bot_id) is called from the sweeper thread, with no lock held.
+    def __init__(self, timeout, on_expired):
+        self.timeout = timeout
+        self.on_expired = on_expired
+        self.cond = threading.Condition()
+        self.heap = []  # (deadline, generation, bot_id) - generations are unique, bot_id is never compared
+        self.current = {}  # {bot_id: generation of its live deadline}
+        self.generation = 0
+        self.thread = None
+
+    def touch(self, bot_id):
+        deadline = time.monotonic() + self.timeout
+        with self.cond:
+            self.generation += 1
+            self.current[bot_id] = self.generation
+            earliest = not self.heap or deadline < self.heap[0][0]
+            heapq.heappush(self.heap, (deadline, self.generation, bot_id))
+            if earliest:
+                self.cond.notify()  # Sweeper is sleeping towards a later deadline
+
+    def forget(self, bot_id):
+        with self.cond:
+            self.current.pop(bot_id, None)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="liveness", daemon=True)
+            self.thread.start()
+
+    def _due(self):
+        # Caller holds self.cond
+        expired = []
+        now = time.monotonic()
+        while self.heap and self.heap[0][0] <= now:
+            _, generation, bot_id = heapq.heappop(self.heap)
+            if self.current.get(bot_id) == generation:  # Else superseded by a later heartbeat
+                del self.current[bot_id]
+                expired.append(bot_id)
+        return expired
+
+    def _run(self):
+        while True:
+            with self.cond:
+                expired = self._due()
+                while not expired:
+                    self.cond.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                    expired = self._due()
+            for bot_id in expired:
+                try:
+                    self.on_expired(bot_id)
+                except Exception as e:
+                    logging.error(f"Liveness handler failed for bot {bot_id}: {e}")
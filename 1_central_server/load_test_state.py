@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+# Load test for the request hot paths (heartbeat / status / can_i_play) at increasing worker
+# thread counts. Default: drives a ServerState in-process (temp dir, no Flask) to measure the
+# state core alone. --url: drives a running server.py over HTTP instead.
+#   python load_test_state.py --threads 1,2,4,8 --seconds 5 --bots 200
+#   python load_test_state.py --url http://127.0.0.1:5000 --threads 1,4,16
+
+MIX = (('heartbeat', 0.7), ('status', 0.2), ('can_i_play', 0.1))
+
+def local_target(bots):
+    from state_manager import ServerState
+    workdir = tempfile.mkdtemp(prefix='state_load_')
+    config = json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')))
+    for key, default in (('state_snapshot_path', 'state_backup.json'), ('state_journal_path', 'state_journal.log'),
+                         ('game_store_dir', 'game_segments'), ('upload_session_dir', 'upload_sessions'),
+                         ('pending_batches_dir', 'pending_batches')):
+        config[key] = os.path.join(workdir, os.path.basename(config.get(key, default)))
+    config_path = os.path.join(workdir, 'config.json')
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+    state = ServerState(config_path)
+    state.load_state()
+    for i in range(bots):
+        state.register_bot(f"bot{i}")
+
+    def call(op, bot_id):
+        if op == 'heartbeat':
+            state.update_heartbeat(bot_id, random.choice(('playing', 'waiting')), random.random())
+        elif op == 'status':
+            state.get_status(bot_id)
+        else:
+            state.can_bot_play(bot_id)
+    return call, state.shutdown
+
+def http_target(url):
+    import requests
+    local = threading.local()
+
+    def call(op, bot_id):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()  # One keep-alive connection per worker
+        if op == 'heartbeat':
+            session.post(f"{url}/heartbeat", json={"bot_id": bot_id, "status": "playing", "game_progress": 0.5}, timeout=10)
+        elif op == 'status':
+            session.get(f"{url}/status", params={"bot_id": bot_id}, timeout=10)
+        else:
+            session.get(f"{url}/can_i_play", params={"bot_id": bot_id}, timeout=10)
+    return call, lambda: None
+
+def run(call, threads, seconds, bots):
+    ops = [op for op, _ in MIX]
+    weights = [w for _, w in MIX]
+    counts = [0] * threads
+    latencies = [[] for _ in range(threads)]
+    stop = time.perf_counter() + seconds
+
+    def worker(i):
+        rng = random.Random(i)
+        while time.perf_counter() < stop:
+            op = rng.choices(ops, weights)[0]
+            t0 = time.perf_counter()
+            call(op, f"bot{rng.randrange(bots)}")
+            latencies[i].append(time.perf_counter() - t0)
+            counts[i] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    samples = sorted(x for lat in latencies for x in lat)
+    return {
+        "threads": threads,
+        "requests_per_second": round(sum(counts) / seconds, 1),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3) if samples else None,
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3) if samples else None
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', default='1,2,4,8')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--bots', type=int, default=200)
+    parser.add_argument('--url', default=None)
+    args = parser.parse_args()
+    call, close = http_target(args.url.rstrip('/')) if args.url else local_target(args.bots)
+    results = []
+    try:
+        for threads in [int(t) for t in args.threads.split(',')]:
+            result = run(call, threads, args.seconds, args.bots)
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+    finally:
+        close()
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,151 @@
+import bisect
+import threading
+
+# Minimal Prometheus-style metrics (one copy each in 1_central_server/, 2_bot_client/ and 3_kaggle_training/ - keep them identical).
+# Histograms have fixed buckets and preallocated counts, so observe() is a bisect and a few
+# adds - no per-sample lists or objects - and can stay on in production hot paths.
+# Updates are not locked: under the GIL a lost increment is possible but rare, and cheaper
+# than a lock per sample. Metric creation (registry lookups) is locked and should happen
+# once, outside the hot path: keep the returned object.
+
+# Seconds. Request/IO latencies
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# Seconds. Per-frame stages (sub-millisecond to a few seconds), fine enough for p50/p95 estimates
+FRAME_BUCKETS = (0.0005, 0.001, 0.002, 0.003, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.075, 0.1,
+                 0.15, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 10.0)
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        # Estimate by linear interpolation inside the bucket holding the q-th sample
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+    def export(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+    @classmethod
+    def from_export(cls, exported):
+        # Rebuilds a histogram from export() output (e.g. scraped with /metrics?format=json).
+        # max is not exported: the upper bound of the highest non-empty bucket stands in (the
+        # last finite bound for +Inf, so quantiles there are a lower bound)
+        histogram = cls(exported['buckets'])
+        histogram.counts = list(exported['counts'])
+        histogram.sum = exported['sum']
+        histogram.count = exported['count']
+        filled = [i for i, n in enumerate(histogram.counts) if n]
+        if filled:
+            histogram.max = histogram.buckets[min(filled[-1], len(histogram.buckets) - 1)]
+        return histogram
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def export(self):
+        return {'value': self.value}
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # {(name, labels tuple): metric}
+        self.help = {}  # {name: (kind, help)}
+
+    def _get(self, cls, name, help, labels, *args):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = cls(*args)
+                    self.help.setdefault(name, (cls.kind, help))
+        return metric
+
+    def histogram(self, name, help='', labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def counter(self, name, help='', labels=None):
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', labels=None):
+        return self._get(Gauge, name, help, labels)
+
+    def export(self):
+        # JSON-able copy (bots push this with their heartbeat)
+        with self.lock:
+            items = list(self.metrics.items())
+        return [dict(metric.export(), name=name, kind=metric.kind, help=self.help[name][1], labels=dict(labels))
+                for (name, labels), metric in items]
+
+    def render(self):
+        return render_exported(self.export())
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels.keys(), escaped)) + '}'
+
+def relabel(exported, **labels):
+    # Adds labels (e.g. bot_id) to every metric of an export
+    return [dict(m, labels=dict(m['labels'], **labels)) for m in exported]
+
+def render_exported(exported):
+    # Prometheus text exposition format (0.0.4) for Registry.export() output. Render all
+    # sources in one call: each metric name gets a single HELP/TYPE header.
+    lines, described = [], set()
+    for m in sorted(exported, key=lambda m: m['name']):
+        name, labels = m['name'], m['labels']
+        if name not in described:
+            described.add(name)
+            if m.get('help'):
+                lines.append(f"# HELP {name} {m['help']}")
+            lines.append(f"# TYPE {name} {m['kind']}")
+        if m['kind'] == 'histogram':
+            cumulative = 0
+            for bound, n in zip(m['buckets'] + ['+Inf'], m['counts']):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(dict(labels, le=bound))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {m['sum']}")
+            lines.append(f"{name}_count{_labels(labels)} {m['count']}")
+        else:
+            lines.append(f"{name}{_labels(labels)} {m['value']}")
+    return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()  # Process-wide default
@@ -0,0 +1,84 @@
+import io
+import os
+import hashlib
+import zipfile
+import threading
+import logging
+
+# Versioned model artifacts for /download_model. 'full' is the trained file as-is; 'fp16'
+# is a lazily built bot copy with float tensors halved and the optimizer state dropped (SB3
+# .zip only), which loads straight back into a float32 policy since load_state_dict casts on
+# copy. Hashes are cached per file state.
+VARIANTS = ('full', 'fp16')
+_lock = threading.Lock()
+_hash_cache = {}  # {(path, mtime_ns, size): sha256}
+
+def file_sha256(path):
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _lock:
+        if key in _hash_cache:
+            return _hash_cache[key]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    with _lock:
+        for stale in [k for k in _hash_cache if k[0] == path]:
+            del _hash_cache[stale]
+        _hash_cache[key] = digest.hexdigest()
+    return _hash_cache[key]
+
+def _half_state(state):
+    # Halve float tensors once per storage: SB3 state dicts alias the shared features
+    # extractor (features_/pi_features_/vf_features_extractor), and torch.save writes a
+    # shared storage only once - halving each entry separately would save it three times
+    import torch
+    halved = {}
+    out = {}
+    for k, v in state.items():
+        if torch.is_tensor(v) and v.is_floating_point():
+            key = (v.data_ptr(), v.shape, v.stride())
+            if key not in halved:
+                halved[key] = v.half()
+            v = halved[key]
+        out[k] = v
+    return out
+
+def _build_fp16(model_path, out_path):
+    # Bot artifact: policy weights halved, no optimizer state (bots never train; inference_engine
+    # loads the policy state dict alone), every entry deflated
+    import torch
+    tmp_path = out_path + '.tmp'
+    with zipfile.ZipFile(model_path) as src, zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+        for item in src.infolist():
+            if item.filename.endswith('optimizer.pth'):
+                continue
+            data = src.read(item.filename)
+            if item.filename.endswith('.pth'):
+                state = torch.load(io.BytesIO(data), map_location='cpu')
+                if isinstance(state, dict):
+                    state = _half_state(state)
+                buf = io.BytesIO()
+                torch.save(state, buf)
+                data = buf.getvalue()
+            dst.writestr(item.filename, data, compress_type=zipfile.ZIP_DEFLATED)
+    os.replace(tmp_path, out_path)
+
+def get_artifact(model_path, version, variant='full'):
+    # Returns (path, sha256, etag) for the requested variant; unknown/unsupported variants get 'full'
+    path = model_path
+    if variant == 'fp16' and zipfile.is_zipfile(model_path):
+        root, ext = os.path.splitext(model_path)
+        path = f"{root}.v{version}.fp16{ext}"
+        with _lock:
+            if not os.path.exists(path):
+                for name in os.listdir(os.path.dirname(path) or '.'):  # Drop older versions' copies
+                    if name.endswith(f".fp16{ext}") and name.startswith(os.path.basename(root) + '.v'):
+                        os.remove(os.path.join(os.path.dirname(path) or '.', name))
+                _build_fp16(model_path, path)
+                logging.info(f"Built fp16 model artifact {path} ({os.path.getsize(path) / 1024 / 1024:.1f}MB)")
+    else:
+        variant = 'full'
+    sha256 = file_sha256(path)
+    return path, sha256, f"v{version}-{variant}-{sha256[:16]}"
@@ -1,18 +1,41 @@
-from flask import Flask, request, jsonify, send_file, render_template_string
+from flask import Flask, Response, request, jsonify, send_file, render_template_string
 from flask_cors import CORS
 from state_manager import ServerState
-from kaggle_client import send_batch_to_kaggle
+import trajectory_codec
+from event_ring import EventRing
+from metrics import REGISTRY, relabel, render_exported
+import model_artifacts
+import json
 import logging
 import os
+import time
 from datetime import datetime
 
 app = Flask(__name__)
 CORS(app)  # For VM cross-origin
 state = ServerState('config.json')  # Load config
+events = EventRing(state.config.get('event_ring_size', 500))  # Dashboard feed
+state.event_listeners.append(events.add)
 state.load_state()  # Restore on start
 
 logging.basicConfig(level=logging.INFO)
 
+bot_metrics = {}  # {bot_id: latest metrics export pushed with its heartbeat (cumulative)}
+
+@app.before_request
+def start_timer():
+    request.environ['metrics.start'] = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    # Per-route latency histogram + status counter; route = URL rule, so ids don't explode labels
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    start = request.environ.get('metrics.start')
+    if start is not None:
+        REGISTRY.histogram('clash_http_request_seconds', 'Request handling time', {'route': route}).observe(time.perf_counter() - start)
+    REGISTRY.counter('clash_http_requests_total', 'Requests', {'route': route, 'status': response.status_code}).inc()
+    return response
+
 @app.route('/heartbeat', methods=['POST'])
 def heartbeat():
     data = request.json
@@ -20,6 +43,8 @@ def heartbeat():
     status = data['status']
     progress = data.get('game_progress', 0.0)
     state.update_heartbeat(bot_id, status, progress)
+    if 'metrics' in data:
+        bot_metrics[bot_id] = data['metrics']
     return jsonify({"acknowledged": True, "server_status": state.get_status(bot_id)})
 
 @app.route('/can_i_play')
@@ -28,15 +53,75 @@ def can_i_play():
     allowed, reason = state.can_bot_play(bot_id)
     return jsonify({"allowed": allowed, "reason": reason})
 
+@app.route('/wait_for_play')
+def wait_for_play():
+    # Long-poll: answers when the bot gets a slot or a newer model is out, else after timeout
+    bot_id = request.args.get('bot_id')
+    known_version = request.args.get('model_version', type=int)
+    timeout = min(request.args.get('timeout', 25.0, type=float), state.config.get('long_poll_max_seconds', 60))
+    return jsonify(state.wait_for_play(bot_id, known_version, timeout))
+
 @app.route('/game_complete', methods=['POST'])
 def game_complete():
+    raw_body = request.get_data()  # Stored as-is, no re-serialization
+    if request.mimetype == trajectory_codec.CONTENT_TYPE:
+        try:
+            data = trajectory_codec.read_meta(raw_body)  # Header only - images stay encoded
+        except ValueError as e:
+            return jsonify({"received": False, "error": str(e)}), 400
+        state.add_game_data(data, raw_body, fmt='bin')
+    else:
+        data = request.get_json()
+        state.add_game_data(data, raw_body)
+    return jsonify({
+        "received": True,
+        "total_games": state.total_games_collected,
+        "games_until_batch": state.collect_limit() - state.total_games_collected
+    })
+
+@app.route('/game_session/start', methods=['POST'])
+def game_session_start():
+    bot_id = request.json['bot_id']
+    return jsonify({"session_id": state.upload_sessions.start(bot_id)})
+
+@app.route('/game_session/<session_id>')
+def game_session_status(session_id):
+    session = state.upload_sessions.status(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown session"}), 404
+    return jsonify(session)
+
+@app.route('/game_session/<session_id>/chunk', methods=['POST'])
+def game_session_chunk(session_id):
+    chunk_index = int(request.args.get('index', -1))
+    try:
+        accepted, next_chunk = state.upload_sessions.append(session_id, chunk_index, request.get_data())
+    except KeyError:
+        return jsonify({"error": "Unknown session"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"acked": accepted, "next_chunk": next_chunk}), (200 if accepted else 409)
+
+@app.route('/game_session/<session_id>/commit', methods=['POST'])
+def game_session_commit(session_id):
     data = request.json
-    bot_id = data['bot_id']
-    state.add_game_data(data)
+    try:
+        sealed = state.upload_sessions.seal(session_id, data, data.pop('chunks', None))
+    except KeyError:
+        return jsonify({"error": "Unknown session"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    if sealed is not None:
+        try:
+            state.add_game_data(*sealed, fmt='bin')
+        except Exception:
+            state.upload_sessions.abort(session_id)  # Not stored: the retried commit must seal again
+            raise
+        state.upload_sessions.finish(session_id)
     return jsonify({
         "received": True,
         "total_games": state.total_games_collected,
-        "games_until_batch": state.config['safety_games'] - state.total_games_collected
+        "games_until_batch": state.collect_limit() - state.total_games_collected
     })
 
 @app.route('/status')
@@ -46,51 +131,167 @@ def status():
 
 @app.route('/download_model')
 def download_model():
+    # ETag (version + content hash) -> 304 when the bot already has it; Range -> resumed downloads
     model_path = state.config['model_save_path']
-    if os.path.exists(model_path):
-        return send_file(model_path, as_attachment=False)
-    else:
+    if not os.path.exists(model_path):
         return "Model not ready", 404
+    path, sha256, etag = model_artifacts.get_artifact(model_path, state.model_version, request.args.get('variant', 'full'))
+    resp = send_file(path, as_attachment=False, conditional=True, etag=etag, max_age=0)
+    # Lets bots verify the download before swapping it in
+    resp.headers['X-Model-Version'] = str(state.model_version)
+    resp.headers['X-Model-Sha256'] = sha256
+    return resp
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape: server histograms/counters, fleet gauges and the bots' pushed metrics
+    view = state.status_view()
+    for name, key in (('clash_games_per_hour', 'games_per_hour'), ('clash_ingest_steps_per_second', 'ingest_steps_per_second'),
+                      ('clash_buffered_games', 'buffered_games'), ('clash_batch_target', 'batch_target'),
+                      ('clash_model_version', 'current_model_version'), ('clash_bots_active', 'bots_active'),
+                      ('clash_reserved_games', 'total_games'), ('clash_bot_idle_fraction', 'bot_idle_fraction')):
+        if view.get(key) is not None:
+            REGISTRY.gauge(name).set(view[key])
+    exported = REGISTRY.export()
+    for bot_id, pushed in list(bot_metrics.items()):
+        exported += relabel(pushed, bot_id=bot_id)
+    if request.args.get('format') == 'json':  # Registry.export() form, for tools (fleet_simulator)
+        return jsonify(exported)
+    return Response(render_exported(exported), mimetype='text/plain; version=0.0.4')
 
 @app.route('/ui')
 def ui():
-    # Render dashboard with state
-    bots_list = "\n".join([f"<tr><td>{id}</td><td>{b['status']}</td><td>{b['progress']:.2f}</td><td>{b['games_completed']}</td></tr>" for id, b in state.bots.items()])
-    recent_events = "Log: Bot1 connected, Game from Bot3 added..."  # From log file parse, or in-memory list
-    html = render_template_string(ui_template, bots=bots_list, status=state.status, games=state.total_games_collected, version=state.model_version, events=recent_events)
-    return html
+    # Static page, rendered once at startup; it pulls /ui/data and follows /ui/events itself
+    return Response(UI_HTML, mimetype='text/html')
+
+@app.route('/ui/data')
+def ui_data():
+    # Full dashboard state + events newer than ?since= (seq of the last event the page has)
+    since = request.args.get('since', 0, type=int)
+    return jsonify({
+        "status": state.status_view(),
+        "bots": [dict(bot, bot_id=bot_id) for bot_id, bot in state.bots.items()],
+        "events": events.since(since, limit=100),
+        "last_seq": events.seq
+    })
+
+@app.route('/ui/events')
+def ui_events():
+    # Server-sent events: one message per event, resumable with Last-Event-ID
+    since = request.headers.get('Last-Event-ID', request.args.get('since', 0), type=int)
 
-# Exact HTML for ui_template (clean table, CSS for mobile/resize)
+    def stream(seq):
+        while True:
+            new = events.wait(seq, timeout=15)
+            if not new:
+                yield ": keep-alive\n\n"
+                continue
+            for event in new:
+                seq = event['seq']
+                yield f"id: {seq}\ndata: {json.dumps(event)}\n\n"
+    return Response(stream(since), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+# Exact HTML for ui_template (clean table, CSS for mobile/resize). Rendered once into UI_HTML;
+# rows and events are filled in by the page script from /ui/data and /ui/events.
 ui_template = """
 <!DOCTYPE html>
 <html>
 <head>
     <title>Clash Royale AI Dashboard</title>
-    <meta http-equiv="refresh" content="10">
     <style>
         body { font-family: Arial; margin: 20px; }
         table { border-collapse: collapse; width: 100%; }
         th, td { border: 1px solid #ddd; padding: 8px; text-align: left; }
         th { background-color: #f2f2f2; }
         .status { font-weight: bold; }
+        #events { max-height: 300px; overflow-y: auto; }
     </style>
 </head>
 <body>
     <h1>Clash Royale AI Dashboard</h1>
-    <p>Server Status: <span class="status">{{ status }}</span></p>
-    <p>Games Collected: {{ games }}/17 (Train on 16)</p>
-    <p>Model Version: {{ version }}</p>
+    <p>Server Status: <span class="status" id="status">-</span></p>
+    <p>Games Collected: <span id="games">-</span>/<span id="limit">-</span> (Train on <span id="batch">{{ batch_size }}</span>)</p>
+    <p>Model Version: <span id="version">-</span></p>
+    <h2>Throughput</h2>
+    <table>
+        <tr><th>Games/hour</th><th>Ingest steps/s</th><th>Training (last / avg s)</th><th>Bots active</th><th>Bot idle share</th></tr>
+        <tr><td id="gph">-</td><td id="sps">-</td><td id="train">-</td><td id="active">-</td><td id="idle">-</td></tr>
+    </table>
     <h2>Bots Status</h2>
     <table>
-        <tr><th>Bot ID</th><th>Status</th><th>Progress</th><th>Games Done</th></tr>
-        {{ bots }}
+        <thead><tr><th>Bot ID</th><th>Status</th><th>Progress</th><th>Games Done</th><th>FPS (last game)</th></tr></thead>
+        <tbody id="bots"></tbody>
     </table>
     <h2>Recent Events</h2>
-    <pre>{{ events }}</pre>
+    <pre id="events"></pre>
+    <script>
+        const safetyMargin = {{ safety_margin }};
+        let lastSeq = 0, refreshTimer = null;
+        const rows = new Map();  // bot_id -> <tr>
+        const text = (id, value) => { document.getElementById(id).textContent = value ?? '-'; };
+        function addEvents(events) {
+            const box = document.getElementById('events');
+            for (const e of events) {
+                lastSeq = Math.max(lastSeq, e.seq);
+                const {seq, time, kind, bot, server, ...fields} = e;
+                box.textContent = `${new Date(time * 1000).toLocaleTimeString()} ${kind} ${JSON.stringify(fields)}\\n` + box.textContent;
+            }
+            box.textContent = box.textContent.split('\\n').slice(0, 200).join('\\n');
+        }
+        function applyServer(s) {
+            // Headline counters: full status from /ui/data, or the subset every event carries
+            text('status', s.server_status); text('games', s.total_games); text('version', s.current_model_version);
+            text('batch', s.batch_target); text('limit', s.batch_target + safetyMargin); text('active', s.bots_active);
+        }
+        function applyBot(b) {
+            // Updates that bot's row in place (new bots are appended)
+            let row = rows.get(b.bot_id);
+            if (!row) {
+                row = document.createElement('tr');
+                for (let i = 0; i < 5; i++) row.appendChild(document.createElement('td'));
+                document.getElementById('bots').appendChild(row);
+                rows.set(b.bot_id, row);
+            }
+            [b.bot_id, b.status, b.progress.toFixed(2), b.games_completed, b.fps ?? '-'].forEach((v, i) => {
+                row.cells[i].textContent = v;
+            });
+        }
+        async function refresh() {
+            // First load and resync only (missed events, slow-moving rates and heartbeat progress)
+            refreshTimer = null;
+            const data = await (await fetch(`/ui/data?since=${lastSeq}`)).json();
+            const s = data.status;
+            applyServer(s);
+            text('gph', s.games_per_hour); text('sps', s.ingest_steps_per_second);
+            text('train', `${s.training_last_seconds ?? '-'} / ${s.training_avg_seconds ?? '-'}`);
+            text('idle', s.bot_idle_fraction);
+            rows.clear();
+            document.getElementById('bots').replaceChildren();
+            data.bots.forEach(applyBot);
+            addEvents(data.events.filter(e => e.seq > lastSeq));
+        }
+        const scheduleRefresh = () => { if (!refreshTimer) refreshTimer = setTimeout(refresh, 500); };
+        function onEvent(message) {
+            const e = JSON.parse(message.data);
+            if (e.seq <= lastSeq) return;  // Already seen (resync overlap)
+            if (e.seq > lastSeq + 1) scheduleRefresh();  // Gap: events were dropped from the ring
+            if (e.server) applyServer(e.server);
+            if (e.bot) applyBot(e.bot);
+            addEvents([e]);
+        }
+        refresh().then(() => {
+            const source = new EventSource(`/ui/events?since=${lastSeq}`);
+            source.onmessage = onEvent;
+        });
+        setInterval(scheduleRefresh, 30000);  // Rates and progress change without events
+    </script>
 </body>
 </html>
 """
+with app.app_context():
+    UI_HTML = render_template_string(ui_template, batch_size=state.config['batch_size'],
+                                     safety_margin=state.config['safety_games'] - state.config['batch_size'])
 
 if __name__ == '__main__':
     logging.info("Starting server on 192.168.86.21:5000")
-    app.run(host=state.config['host'], port=state.config['port'], debug=False)
+    app.run(host=state.config['host'], port=state.config['port'], debug=False, threaded=True)  # One thread per long-poll
@@ -1,122 +1,451 @@
 import json
-from threading import Lock
-from datetime import datetime
+import os
+import math
+import time
+import atexit
+from collections import deque, Counter
+import threading
+from threading import Timer, Condition
 import logging
+from state_journal import StateJournal
+from game_store import GameStore
+from upload_sessions import UploadSessions
+from training_queue import TrainingQueue
+from bot_registry import BotRegistry
+from liveness import LivenessMonitor
+from timed_lock import TimedLock
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+class SlotCounter:
+    # Game-slot reservations: check-and-increment under its own small lock, not the state lock.
+    # on_change runs under the lock so the journaled value is never older than a granted slot.
+    # held tracks which bot holds which reservations, so a dead bot's slots can be given back.
+    def __init__(self, on_change=None):
+        self.lock = TimedLock('slots')
+        self.value = 0
+        self.held = Counter()  # {bot_id: reserved games not yet received}
+        self.on_change = on_change
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def try_reserve(self, limit, holder=None):
+        # New count, or None if the limit is reached
+        with self.lock:
+            if self.value + 1 > limit:
+                return None
+            self.value += 1
+            if holder is not None:
+                self.held[holder] += 1
+            self._changed()
+            return self.value
+
+    def consume(self, holder):
+        # The holder's game arrived: the slot is now a buffered game, no longer reclaimable
+        with self.lock:
+            if self.held.get(holder, 0) > 0:
+                self.held[holder] -= 1
+                if not self.held[holder]:
+                    del self.held[holder]
+                self._changed()
+
+    def reclaim(self, holder):
+        # Holder died: free its outstanding slots. Returns how many
+        with self.lock:
+            count = self.held.pop(holder, 0)
+            if count:
+                self.value = max(0, self.value - count)
+                self._changed()
+            return count
+
+    def set(self, value, holders=None):
+        # holders: replace the reservation map too ({} at a round reset, journal replay)
+        with self.lock:
+            self.value = value
+            if holders is not None:
+                self.held = Counter(holders)
+            self._changed()
+
 class ServerState:
+    # Lock layout: self.lock (round state: status, buffer, model version, training) is only taken
+    # on transitions; bots live in a lock-sharded BotRegistry and slots in a SlotCounter, so the
+    # per-request paths (heartbeat, can_i_play, status) don't serialize on it. get_status reads
+    # self.view, a dict republished on every transition and never mutated afterwards.
     def __init__(self, config_path):
         self.config = json.load(open(config_path))
-        self.lock = Lock()
-        self.reset_state()
-        self.bots = {}  # {id: {'status': str, 'games_completed': int, 'last_heartbeat': datetime, 'progress': float}}
+        self.lock = TimedLock('state')  # Reentrant (RLock): transitions call each other
+        # Wakes long-polling bots on slot/status/model transitions. Its own small lock, not the state
+        # lock: parked long-polls never touch the state lock; change_seq makes a wakeup that lands
+        # between a waiter's check and its wait() count (see _wake_waiters / wait_for_play)
+        self.changed = Condition(TimedLock('changed', threading.Lock()))
+        self.change_seq = 0
+        self.journal = StateJournal(
+            self.config.get('state_snapshot_path', 'state_backup.json'),
+            self.config.get('state_journal_path', 'state_journal.log'),
+            flush_interval=self.config.get('journal_flush_interval', 1.0),
+            compact_records=self.config.get('journal_compact_records', 5000))
+        self.bots = BotRegistry(self.config.get('bot_shards', 16), on_change=self._journal_bot)
+        self.slots = SlotCounter(on_change=self._journal_counters)
+        # Dead bots: marked crashed and their reserved slots reclaimed once heartbeats stop
+        self.liveness = LivenessMonitor(self.config['heartbeat_timeout'], self._bot_expired)
+        self.event_listeners = []  # Callables (kind, fields) - bot crashed/recovered, ...
+        self.status = "collecting"
         self.model_version = 0
-        self.games_buffer = []  # List of game_complete dicts
+        self.game_store = GameStore(
+            self.config.get('game_store_dir', 'game_segments'),
+            segment_max_bytes=self.config.get('game_segment_max_mb', 64) * 1024 * 1024)
+        self.games_buffer = []  # List of GameStore index entries (game bodies live on disk)
+        self.buffer_versions = Counter()  # {model_version: buffered games}, kept incrementally
+        self.upload_sessions = UploadSessions(
+            self.config.get('upload_session_dir', 'upload_sessions'),
+            max_age_seconds=self.config.get('upload_session_max_age_seconds', 3600))
+        self.training_queue = None  # Started by load_state, after state is restored
+        # Pipelined collection: bots keep playing model N while N+1 trains (status stays 'collecting')
+        self.pipelined = self.config.get('pipeline_collection', True)
+        self.training_in_flight = 0  # Queued/running training jobs
+        self.batch_target = self.config['batch_size']  # Adapted to training time x fleet game rate
+        self.game_arrivals = deque()  # (time.time(), steps) of games received in the last hour
+        self.window_steps = 0  # Sum of steps in game_arrivals
+        self.last_training_seconds = None
+        self.started_at = time.time()
+        self.view = {}
+        self.reset_state()
         logging.info("ServerState initialized")
 
     def reset_state(self):
+        # Non-pipelined round boundary: everything not yet buffered is a new round
         with self.lock:
-            self.total_games_collected = 0
             self.status = "collecting"  # collecting | training | ready
-            self.save_state()  # Backup to file for restarts
+            self.slots.set(len(self.games_buffer), holders={})  # Extras from the last batch carry over
+            self._publish()
+            self._wake_waiters()
 
-    def save_state(self):
-        state = {
-            'total_games_collected': self.total_games_collected,
-            'status': self.status,
-            'model_version': self.model_version,
-            'bots': self.bots,
-            'games_buffer_len': len(self.games_buffer)  # Don't save full buffer to save space
+    def _wake_waiters(self):
+        with self.changed:
+            self.change_seq += 1
+            self.changed.notify_all()
+
+    @property
+    def total_games_collected(self):
+        return self.slots.value
+
+    @total_games_collected.setter
+    def total_games_collected(self, value):
+        self.slots.set(value)  # Journals the counters
+
+    def _journal_counters(self):
+        # Memory only, the journal flusher writes it out. Under the slot lock: a concurrent
+        # reservation can't journal its count and then be overwritten by an older one.
+        with self.slots.lock:
+            self.journal.record('counters', 'server', {
+                'total_games_collected': self.slots.value,
+                'reservations': [[bot_id, n] for bot_id, n in self.slots.held.items()],  # Pairs keep int ids
+                'status': self.status,
+                'model_version': self.model_version
+            })
+
+    def _journal_bot(self, bot_id, record):
+        self.journal.record('bot', bot_id, record.to_dict())
+
+    def _publish(self):
+        # Caller holds self.lock. Replaces (never mutates) the dict get_status reads without locking
+        avg = self.training_queue.average_duration() if self.training_queue else None
+        self.view = {
+            "server_status": self.status,
+            "should_wait": self.status != "collecting",
+            "current_model_version": self.model_version,
+            "update_available": self.status == "ready",
+            "eta_seconds": 0 if self.status != "training" else round(avg or 120),  # Measured, else estimate 2 min
+            "batch_target": self.batch_target,
+            "buffered_games": len(self.games_buffer),
+            "buffer_model_versions": {str(v): n for v, n in self.buffer_versions.items() if n > 0},  # str: JSON keys
+            "games_per_hour": round(self.games_per_hour(), 1),
+            "ingest_steps_per_second": round(self.window_steps / self._window(), 2),
+            "training_avg_seconds": None if avg is None else round(avg, 1),
+            "training_last_seconds": None if self.last_training_seconds is None else round(self.last_training_seconds, 1)
         }
-        with open('state_backup.json', 'w') as f:
-            json.dump(state, f)
-        # Delete old buffer if ready (space)
+
+    def _snapshot(self):
+        # Slot value and reservations under the slot lock, like _journal_counters: try_reserve,
+        # consume and reclaim change them without the state lock
+        with self.lock, self.slots.lock:
+            return {
+                'seq': self.journal.cut(),
+                'total_games_collected': self.slots.value,
+                'reservations': [[bot_id, n] for bot_id, n in self.slots.held.items()],
+                'status': self.status,
+                'model_version': self.model_version,
+                'bots': dict(self.bots.items()),
+                'games_buffer_len': len(self.games_buffer)  # Buffer itself is recovered from the game store
+            }
+
+    def save_state(self):
+        # Synchronous snapshot + journal truncate (shutdown, after training) - not for the request path
+        self.journal.compact(self._snapshot)
 
     def load_state(self):
-        try:
-            with open('state_backup.json', 'r') as f:
-                state = json.load(f)
-                self.total_games_collected = state['total_games_collected']
-                self.status = state['status']
-                self.model_version = state['model_version']
-                self.bots = state['bots']
-                # Rebuild buffer if needed (from log files, but skip for space - restart loses buffer)
-            logging.info("State loaded from backup")
-        except FileNotFoundError:
+        snapshot, records = self.journal.replay()
+        with self.lock:
+            if snapshot is not None:
+                self.status = snapshot['status']
+                self.model_version = snapshot['model_version']
+                self.slots.set(snapshot['total_games_collected'], dict(map(tuple, snapshot.get('reservations', []))))
+                for bot_id, bot in snapshot['bots'].items():
+                    self.bots.load(bot_id, bot)
+            for rec in records:
+                if rec['kind'] == 'counters':
+                    self.status = rec['fields']['status']
+                    self.model_version = rec['fields']['model_version']
+                    self.slots.set(rec['fields']['total_games_collected'], dict(map(tuple, rec['fields'].get('reservations', []))))
+                elif rec['kind'] == 'bot':
+                    self.bots.load(rec['key'], rec['fields'])
+        games = self.game_store.load()
+        with self.lock:
+            self.games_buffer = games
+            self.buffer_versions = Counter(e.get('model_version') for e in games)
+        if snapshot is None and not records:
             logging.warning("No backup found, starting fresh")
+        else:
+            logging.info(f"State loaded from backup + {len(records)} journal records")
+        self.training_queue = TrainingQueue(self.config, self.game_store, self._training_done, self._training_failed)
+        with self.lock:
+            self.training_in_flight = len([j for j in self.training_queue.summary() if j['status'] in ('queued', 'running')])
+            if self.status == "training" and not self.training_in_flight:
+                self.reset_state()  # Crashed before the batch was handed off - games are still buffered
+            if self.status == "ready" or (self.pipelined and self.status == "training"):
+                self.reset_state()
+            self._maybe_start_training()
+            self._publish()
+        self.save_state()  # Fold the replayed journal into a fresh snapshot
+        self.journal.start(self._snapshot)
+        for bot_id, bot in self.bots.items():
+            if bot['status'] != 'crashed':
+                self.liveness.touch(bot_id)  # Full timeout from restart to check back in
+        self.liveness.start()
+        atexit.register(self.shutdown)
+
+    def shutdown(self):
+        self.journal.close(self._snapshot)
+
+    def _emit(self, kind, **fields):
+        # Events carry what they changed, so the dashboard applies them without refetching
+        # /ui/data: the bot's row (bot events) and the headline counters (all lock-free reads)
+        if 'bot_id' in fields:
+            record = self.bots.get(fields['bot_id'])
+            if record is not None:
+                fields['bot'] = {'bot_id': fields['bot_id'], 'status': record.status, 'progress': record.progress,
+                                 'games_completed': record.games_completed, 'fps': record.fps}
+        fields['server'] = {'server_status': self.status, 'total_games': self.total_games_collected,
+                            'current_model_version': self.model_version, 'batch_target': self.batch_target,
+                            'bots_active': self.bots.active}
+        for listener in self.event_listeners:
+            listener(kind, fields)
 
     def register_bot(self, bot_id):
-        with self.lock:
-            if bot_id not in self.bots:
-                self.bots[bot_id] = {'status': 'idle', 'games_completed': 0, 'last_heartbeat': datetime.now(), 'progress': 0.0}
-                logging.info(f"New bot registered: {bot_id}")
-            return True
+        if self.bots.register(bot_id):  # Shard lock only
+            self.liveness.touch(bot_id)
+            logging.info(f"New bot registered: {bot_id}")
+            self._emit('bot_joined', bot_id=bot_id)
+        return True
 
     def update_heartbeat(self, bot_id, status, progress):
-        with self.lock:
-            if bot_id not in self.bots:
-                self.register_bot(bot_id)
-            self.bots[bot_id]['status'] = status
-            self.bots[bot_id]['progress'] = progress
-            self.bots[bot_id]['last_heartbeat'] = datetime.now()
-            # Check timeout
-            if (datetime.now() - self.bots[bot_id]['last_heartbeat']).seconds > self.config['heartbeat_timeout']:
-                self.bots[bot_id]['status'] = 'crashed'
-                logging.warning(f"Bot {bot_id} timed out")
-            self.save_state()
+        # Shard lock only; busy/idle time is credited by the status the bot reported last time
+        previous = self.bots.get(bot_id)
+        was_crashed = previous is not None and previous.status == 'crashed'
+        self.bots.heartbeat(bot_id, status, progress, self.config['heartbeat_timeout'])
+        self.liveness.touch(bot_id)
+        if was_crashed:
+            logging.info(f"Bot {bot_id} is back")
+            self._emit('bot_recovered', bot_id=bot_id)
+
+    def _bot_expired(self, bot_id):
+        # Liveness thread: no heartbeat for heartbeat_timeout seconds
+        self.bots.set_status(bot_id, 'crashed')
+        reclaimed = self.slots.reclaim(bot_id)  # Its games will never arrive - let other bots play them
+        logging.warning(f"Bot {bot_id} timed out: marked crashed, {reclaimed} reserved slot(s) reclaimed")
+        self._emit('bot_crashed', bot_id=bot_id, reclaimed_slots=reclaimed)
+        if reclaimed:
+            self._wake_waiters()  # Long-polling bots can take the freed slots
 
     def can_bot_play(self, bot_id):
+        self.register_bot(bot_id)  # Auto-register
+        if self.status != "collecting":
+            return False, "Server not collecting"
+        limit = self.collect_limit()
+        reserved = self.slots.try_reserve(limit, holder=bot_id)  # Atomic check-and-reserve
+        if reserved is None:
+            return False, "Would exceed safety limit"
+        return True, f"OK, {limit - reserved} remaining"
+
+    def wait_for_play(self, bot_id, known_version=None, timeout=25.0):
+        # Long-poll version of can_bot_play: blocks until a slot is granted, a model newer than
+        # known_version is published or timeout passes. Idle bots cost one request per timeout.
+        # can_bot_play synchronizes through SlotCounter/BotRegistry, so no state lock here at all
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.changed:
+                seen = self.change_seq
+            allowed, reason = self.can_bot_play(bot_id)
+            if allowed or (known_version is not None and self.model_version > known_version):
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self.changed:
+                if self.change_seq == seen:  # Otherwise something changed since the check: look again
+                    self.changed.wait(remaining)
+        return {
+            "allowed": allowed,
+            "reason": reason,
+            "server_status": self.status,
+            "current_model_version": self.model_version
+        }
+
+    def add_game_data(self, game_data, raw_body=None, fmt='json'):
+        # Persist the game once, outside the state lock; only its index entry stays in memory
+        # fmt: 'json' (game_data is the full upload) | 'bin' (game_data is trajectory_codec metadata)
+        if raw_body is None:
+            raw_body = json.dumps(game_data).encode('utf-8')
+        entry = self.game_store.append(raw_body, game_data, fmt)
+        bot_id = game_data['bot_id']
+        duration = (game_data.get('game_metadata') or {}).get('duration_seconds')
+        self.bots.game_completed(bot_id, fps=round(entry['steps'] / duration, 2) if duration else None)
+        self.slots.consume(bot_id)
+        self._emit('game_received', bot_id=bot_id, steps=entry['steps'], reward=entry['reward'],
+                   model_version=entry.get('model_version'))
         with self.lock:
-            self.register_bot(bot_id)  # Auto-register
-            if self.status != "collecting":
-                return False, "Server not collecting"
-            hypothetical_total = self.total_games_collected + 1
-            if hypothetical_total > self.config['safety_games']:
-                return False, "Would exceed safety limit"
-            # Reserve slot (atomic)
-            self.total_games_collected += 1
-            return True, f"OK, {self.config['safety_games'] - hypothetical_total} remaining"
-
-    def add_game_data(self, game_data):
+            self.games_buffer.append(entry)
+            self.buffer_versions[entry.get('model_version')] += 1
+            self.game_arrivals.append((time.time(), entry['steps']))
+            self.window_steps += entry['steps']
+            logging.info(f"Game added from bot {bot_id} (model v{entry.get('model_version')}), total: {len(self.games_buffer)}")
+            self._maybe_start_training()
+            self._publish()
+
+    def collect_limit(self):
+        # Reservations allowed before the current batch is full (+ safety margin for late games)
+        return self.batch_target + self.config['safety_games'] - self.config['batch_size']
+
+    def _window(self):
+        # Caller holds self.lock. Drops arrivals older than an hour; returns the window length
+        now = time.time()
+        while self.game_arrivals and self.game_arrivals[0][0] < now - 3600:
+            self.window_steps -= self.game_arrivals.popleft()[1]
+        return min(3600.0, max(now - self.started_at, 60.0))
+
+    def games_per_hour(self):
+        # Rate over the last hour (or since start)
         with self.lock:
-            self.games_buffer.append(game_data)
-            bot_id = game_data['bot_id']
-            if bot_id in self.bots:
-                self.bots[bot_id]['games_completed'] += 1
-            self.save_state()
-            logging.info(f"Game added from bot {bot_id}, total: {len(self.games_buffer)}")
-            if len(self.games_buffer) >= self.config['batch_size']:
-                self.start_training()
+            return len(self.game_arrivals) * 3600.0 / self._window()
+
+    def _adapt_batch_size(self):
+        # Size the batch so collecting the next one takes about as long as training this one:
+        # the fleet never idles waiting for a model and training never falls behind
+        if not self.config.get('adaptive_batch', True):
+            return
+        avg = self.training_queue.average_duration() if self.training_queue else None
+        rate = self.games_per_hour() / 3600.0
+        if not avg or not rate:
+            return
+        target = math.ceil(rate * avg)
+        target = max(self.config.get('batch_size_min', self.config['batch_size']), min(target, self.config.get('batch_size_max', 256)))
+        if target != self.batch_target:
+            logging.info(f"Batch size {self.batch_target} -> {target} ({rate * 3600:.0f} games/h, training {avg:.0f}s)")
+            self.batch_target = target
+
+    def _maybe_start_training(self):
+        with self.lock:
+            if len(self.games_buffer) < self.batch_target:
+                return
+            if self.training_in_flight >= self.config.get('max_training_in_flight', 1):
+                return  # Next batch waits for the running (or retrying) job; bots keep collecting up to collect_limit()
+            self.start_training()
 
     def start_training(self):
+        # Only enqueues - the TrainingQueue worker builds the batch file and trains
         with self.lock:
             if self.status == "training":
                 return  # Already training
-            self.status = "training"
-            logging.info("Batch ready - starting training")
-            # Call kaggle_client.send_batch(self.games_buffer[:self.config['batch_size']])  # First 16
-            # self.games_buffer = self.games_buffer[self.config['batch_size']:]  # Keep extras if any, discard on upload
-            # Simulate wait (in real: async thread)
-            # On complete: self.model_version += 1; self.status = "ready"; self.reset_state()
+            batch_size = self.batch_target
+            batch = self.games_buffer[:batch_size]  # First batch_target (index entries)
+            self.games_buffer = self.games_buffer[batch_size:]  # Keep extras if any
+            versions = Counter(e.get('model_version') for e in batch)
+            self.buffer_versions.subtract(versions)
+            if self.pipelined:
+                with self.slots.lock:  # In-flight reservations roll into the next batch
+                    self.total_games_collected = max(0, self.slots.value - len(batch))
+            else:
+                self.status = "training"
+                self._journal_counters()
+            self.training_in_flight += 1
+            self.training_queue.enqueue(batch)
+            logging.info(f"Batch of {len(batch)} ready (model versions {dict(versions)}) - training job queued")
+            self._adapt_batch_size()  # For the batch being collected now
+            self._emit('training_started', games=len(batch), steps=sum(e['steps'] for e in batch))
+            self._publish()
+            self._wake_waiters()  # Pipelined: the batch handoff frees reservation slots
 
-    def get_status(self, bot_id):
+    def _training_done(self, job, model_path):
+        # Worker thread: publish the new model, hold 'ready' so polling bots pick it up, then resume
+        model_save_path = self.config['model_save_path']
+        os.makedirs(os.path.dirname(model_save_path) or '.', exist_ok=True)
+        os.replace(model_path, model_save_path)
         with self.lock:
-            self.register_bot(bot_id)
-            eta = 0 if self.status != "training" else 120  # Estimate 2 min
-            return {
-                "server_status": self.status,
-                "should_wait": self.status != "collecting",
-                "current_model_version": self.model_version,
-                "update_available": self.status == "ready",
-                "eta_seconds": eta,
-                "total_games": self.total_games_collected,
-                "bots_active": len([b for b in self.bots.values() if b['status'] != 'crashed'])
-            }
+            self.model_version += 1
+            self.last_training_seconds = job['duration']
+            self.training_in_flight = max(0, self.training_in_flight - 1)
+            if self.pipelined:
+                self._journal_counters()
+                self._adapt_batch_size()
+                self._maybe_start_training()  # Bots pick the new version up via their model poll
+            else:
+                self.status = "ready"
+                self._journal_counters()
+            self._publish()
+            self._wake_waiters()  # Waiting bots learn about the new version immediately
+        logging.info(f"Model v{self.model_version} published")
+        self._emit('training_finished', job=job['id'], seconds=round(job['duration'], 1))
+        self._emit('model_published', version=self.model_version)
+        if not self.pipelined:
+            Timer(self.config.get('ready_hold_seconds', 30), self._resume_collecting).start()
+
+    def _training_failed(self, job, error):
+        # Backend down: the queue retries the batch in the background and the job stays in flight.
+        # Non-pipelined, the round (status 'training', slot map) only ends once it failed for good
+        self._emit('training_failed', job=job['id'], attempts=job['attempts'], error=str(error))
+        with self.lock:
+            if job['status'] == 'failed':
+                self.training_in_flight = max(0, self.training_in_flight - 1)  # No more retries
+                if self.status == "training":
+                    self.reset_state()
+            self._publish()
+
+    def _resume_collecting(self):
+        with self.lock:
+            if self.status != "ready":
+                return
+            self.reset_state()
+            self._maybe_start_training()
+
+    def get_status(self, bot_id):
+        self.register_bot(bot_id)
+        return self.status_view()
+
+    def status_view(self):
+        # No state lock: published view + O(1) live counters (active bots, slots, idle share)
+        idle = self.bots.idle_fraction()
+        return dict(self.view,
+                    total_games=self.total_games_collected,
+                    bots_active=self.bots.active,
+                    training_jobs=self.training_queue.summary() if self.training_queue else [],
+                    bot_idle_fraction=None if idle is None else round(idle, 3))
 
     # Edge Cases Handled:
     # - Bot add/remove: Auto-register on heartbeat, ignore crashed in counts.
-    # - Over-batch: Lock prevents >17.
-    # - Crash: Timeout marks 'crashed', others continue (compensate by allowing more plays).
-    # - Restart: Load backup, resume status (lose buffer = recollect).
+    # - Over-batch: SlotCounter prevents > batch_target + safety margin reservations.
+    # - Pipelined: games keep arriving (tagged with their model_version) while the previous batch trains.
+    # - Crash: LivenessMonitor marks 'crashed' after heartbeat_timeout and reclaims the bot's reserved slots.
+    # - Restart: Load snapshot + replay journal, resume status; games buffer rebuilt from game store segments.
     # - Dynamic bots: No fixed count; batch fills from whoever connects.
@@ -0,0 +1,120 @@
+import os
+import time
+import heapq
+import threading
+import logging
+import kaggle_client
+
+class TrainingQueue:
+    # Background training scheduler. start_training() only enqueues a job; worker threads
+    # write the batch file into pending_batches/, hand it to the kaggle_client backend and
+    # call on_done(job, model_path). A failed job keeps its batch file and is retried with
+    # exponential backoff; batch files left in pending_batches/ are re-queued on restart.
+    def __init__(self, config, game_store, on_done, on_failed=None):
+        backend = config.get('kaggle_endpoint', 'local')
+        if backend not in kaggle_client.BACKENDS:  # Fail at startup, not as retried training jobs
+            raise ValueError(f"Unknown kaggle_endpoint {backend!r}, expected one of {sorted(kaggle_client.BACKENDS)}")
+        self.config = config
+        self.game_store = game_store
+        self.on_done = on_done
+        self.on_failed = on_failed
+        self.pending_dir = config.get('pending_batches_dir', 'pending_batches')
+        self.retry_seconds = config.get('training_retry_seconds', 300)
+        self.max_attempts = config.get('training_max_attempts', 5)
+        self.cond = threading.Condition()
+        self.ready = []  # Heap of (not_before, job_id)
+        self.jobs = {}  # {job_id: job dict}, last few kept for /status
+        self.next_id = 1
+        os.makedirs(self.pending_dir, exist_ok=True)
+        for name in sorted(os.listdir(self.pending_dir)):
+            if name.endswith('.json'):
+                self._add({'batch_file': os.path.join(self.pending_dir, name), 'entries': None})
+        if self.jobs:
+            logging.info(f"Training queue: {len(self.jobs)} pending batches re-queued")
+        for i in range(config.get('training_workers', 1)):
+            threading.Thread(target=self._worker, name=f"trainer-{i}", daemon=True).start()
+
+    def _add(self, job):
+        with self.cond:
+            job.update(id=self.next_id, status='queued', attempts=0, error=None, model_path=None,
+                       queued_at=time.time(), started_at=None, finished_at=None, duration=None)
+            self.next_id += 1
+            self.jobs[job['id']] = job
+            heapq.heappush(self.ready, (0, job['id']))
+            self.cond.notify()
+            return job['id']
+
+    def enqueue(self, entries):
+        # entries: GameStore index entries for one batch - nothing is read or written here
+        job_id = self._add({'batch_file': None, 'entries': list(entries), 'games': len(entries)})
+        logging.info(f"Training job {job_id} queued ({len(entries)} games)")
+        return job_id
+
+    def _worker(self):
+        while True:
+            with self.cond:
+                while not self.ready or self.ready[0][0] > time.time():
+                    self.cond.wait(None if not self.ready else self.ready[0][0] - time.time())
+                _, job_id = heapq.heappop(self.ready)
+                job = self.jobs[job_id]
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+                job['attempts'] += 1
+            try:
+                if job['batch_file'] is None:
+                    job['batch_file'] = kaggle_client.make_batch_file(self.game_store, job['entries'], self.pending_dir)
+                    self.game_store.release(job['entries'])  # Batch file is the durable copy now
+                    job['entries'] = None
+                model_path = kaggle_client.send_batch_to_kaggle(job['batch_file'], self.config)
+            except Exception as e:
+                self._failed(job, e)
+                continue
+            with self.cond:
+                job['status'] = 'done'
+                job['model_path'] = model_path
+                job['finished_at'] = time.time()
+                job['duration'] = job['finished_at'] - job['started_at']
+            os.remove(job['batch_file'])  # Delete batch after (space)
+            logging.info(f"Training job {job_id} done in {job['duration']:.0f}s: {model_path}")
+            self._prune()
+            self.on_done(job, model_path)
+
+    def _failed(self, job, error):
+        with self.cond:
+            job['error'] = str(error)
+            job['finished_at'] = time.time()
+            job['duration'] = job['finished_at'] - job['started_at']
+            if job['attempts'] < self.max_attempts:
+                delay = self.retry_seconds * 2 ** (job['attempts'] - 1)
+                job['status'] = 'queued'
+                heapq.heappush(self.ready, (time.time() + delay, job['id']))
+                self.cond.notify()
+                logging.error(f"Training job {job['id']} failed ({error}), retry {job['attempts']}/{self.max_attempts} in {delay}s")
+            else:
+                job['status'] = 'failed'
+                logging.error(f"Training job {job['id']} failed permanently, batch kept at {job['batch_file']}")
+        if self.on_failed is not None:
+            self.on_failed(job, error)
+
+    def _prune(self, keep=20):
+        with self.cond:
+            finished = [j for j in self.jobs.values() if j['status'] in ('done', 'failed')]
+            for job in sorted(finished, key=lambda j: j['id'])[:-keep]:
+                del self.jobs[job['id']]
+
+    def average_duration(self):
+        with self.cond:
+            durations = [j['duration'] for j in self.jobs.values() if j['status'] == 'done']
+        return sum(durations) / len(durations) if durations else None
+
+    def summary(self):
+        now = time.time()
+        with self.cond:
+            return [{
+                'id': j['id'],
+                'status': j['status'],
+                'attempts': j['attempts'],
+                'waited_seconds': round((j['started_at'] or now) - j['queued_at'], 1),
+                'duration_seconds': round(j['duration'], 1) if j['duration'] is not None else None,
+                'error': j['error']
+            } for j in sorted(self.jobs.values(), key=lambda j: j['id'])]
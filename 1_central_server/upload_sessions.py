@@ -0,0 +1,143 @@
+import os
+import time
+import uuid
+import threading
+import logging
+import trajectory_codec
+
+class UploadSessions:
+    # Streaming game uploads: a bot opens a session, pushes trajectory_codec chunks in
+    # order (each appended to <session>.part as soon as it arrives) and commits at game end,
+    # which seals the chunks into one binary game for the GameStore. Chunk indexes make
+    # retries idempotent: a resent chunk below the next expected index is just re-acked.
+    def __init__(self, directory, max_age_seconds=3600):
+        self.directory = directory
+        self.max_age_seconds = max_age_seconds
+        self.lock = threading.Lock()
+        self.sessions = {}  # {session_id: {'bot_id', 'next_chunk', 'bytes', 'updated'}}
+        self.sealing = set()  # Commit in progress - a concurrent second commit must not seal it again
+        self.committed = set()  # Stored this run - a retried commit (lost ack) is not an error
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+
+    def _path(self, session_id):
+        return os.path.join(self.directory, f"{session_id}.part")
+
+    def _iter_records(self, session_id, limit=None):
+        # Chunk bodies one at a time; limit: only the first limit bytes of the .part file
+        with open(self._path(session_id), 'rb') as f:
+            while limit is None or f.tell() < limit:
+                header = f.read(trajectory_codec.BATCH_RECORD.size)
+                if len(header) < trajectory_codec.BATCH_RECORD.size:
+                    break
+                _, length = trajectory_codec.BATCH_RECORD.unpack(header)
+                body = f.read(length)
+                if len(body) < length:
+                    break  # Torn last chunk - the bot never got its ack and will resend
+                yield body
+
+    def _recover(self):
+        # Sessions survive a server restart: rebuild progress from the .part files
+        for name in os.listdir(self.directory):
+            if not name.endswith('.part'):
+                continue
+            session_id = name[:-len('.part')]
+            count, valid, bot_id = 0, 0, None
+            for body in self._iter_records(session_id):
+                if count == 0:
+                    bot_id = trajectory_codec.read_meta(body)['bot_id']
+                count += 1
+                valid += len(body) + trajectory_codec.BATCH_RECORD.size
+            with open(self._path(session_id), 'r+b') as f:
+                f.truncate(valid)
+            self.sessions[session_id] = {'bot_id': bot_id, 'next_chunk': count, 'bytes': valid,
+                                         'updated': os.path.getmtime(self._path(session_id))}
+        if self.sessions:
+            logging.info(f"Upload sessions: recovered {len(self.sessions)} in-progress games")
+
+    def start(self, bot_id):
+        self.expire()
+        session_id = uuid.uuid4().hex
+        with self.lock:
+            open(self._path(session_id), 'wb').close()
+            self.sessions[session_id] = {'bot_id': bot_id, 'next_chunk': 0, 'bytes': 0, 'updated': time.time()}
+        return session_id
+
+    def status(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            return None if session is None else {'session_id': session_id, 'next_chunk': session['next_chunk']}
+
+    def append(self, session_id, chunk_index, body):
+        # Returns (accepted, next_chunk). accepted=False means a gap: the bot resumes at next_chunk
+        trajectory_codec.read_meta(body)  # Reject garbage before it reaches disk (ValueError)
+        with self.lock:
+            session = self.sessions[session_id]  # KeyError -> unknown/expired session
+            if chunk_index < session['next_chunk']:
+                return True, session['next_chunk']  # Duplicate (lost ack) - already stored
+            if chunk_index > session['next_chunk']:
+                return False, session['next_chunk']
+            with open(self._path(session_id), 'ab') as f:
+                f.write(trajectory_codec.BATCH_RECORD.pack(trajectory_codec.BATCH_FORMATS['bin'], len(body)) + body)
+                f.flush()
+                os.fsync(f.fileno())
+            session['next_chunk'] += 1
+            session['bytes'] += len(body) + trajectory_codec.BATCH_RECORD.size
+            session['updated'] = time.time()
+            return True, session['next_chunk']
+
+    def seal(self, session_id, metadata, expected_chunks=None):
+        # Concatenate the chunks into one binary game (JPEGs are copied, never decoded).
+        # metadata: bot_id, timestamp, game_metadata, total_reward, total_steps from the commit call.
+        # Returns None if this session was already committed, else (metadata for add_game_data,
+        # sealed game body as a generator of bytes). Only the session bookkeeping happens under the
+        # lock: the chunk columns are read here, the images stream from the .part file while the
+        # body is written - never the whole game in memory. The caller must follow with finish()
+        # once the game is in the GameStore, or abort() if storing it failed: until then the
+        # session is only marked in progress and the .part file is kept, so a failure before the
+        # game reaches the GameStore loses nothing and the bot's retried commit seals it again.
+        with self.lock:
+            if session_id in self.committed:
+                return None
+            if session_id in self.sealing:
+                raise ValueError("Commit already in progress")
+            session = self.sessions[session_id]
+            if expected_chunks is not None and session['next_chunk'] != expected_chunks:
+                raise ValueError(f"Session has {session['next_chunk']} chunks, commit expects {expected_chunks}")
+            size = session['bytes']  # Chunks appended after the commit are not part of this game
+            self.sealing.add(session_id)
+        try:
+            payload = dict(metadata, bot_id=metadata.get('bot_id', session['bot_id']))
+            # Uncompressed: JPEG blobs don't compress further; keeps sealing cheap
+            return trajectory_codec.concat_games(lambda: self._iter_records(session_id, size), payload)
+        except Exception:
+            self.abort(session_id)  # Invalid game (ValueError): the commit can be retried
+            raise
+
+    def abort(self, session_id):
+        # Sealed game did not reach the GameStore (I/O error, torn chunk read) - allow a retry
+        with self.lock:
+            self.sealing.discard(session_id)
+
+    def finish(self, session_id):
+        # Sealed game is durable in the GameStore - mark it committed and drop the chunk file
+        with self.lock:
+            self.sealing.discard(session_id)
+            self.committed.add(session_id)
+            self.sessions.pop(session_id, None)
+            try:
+                os.remove(self._path(session_id))
+            except FileNotFoundError:
+                pass
+
+    def expire(self):
+        # Abandoned games (bot crashed mid-game and never committed)
+        cutoff = time.time() - self.max_age_seconds
+        with self.lock:
+            for session_id in [s for s, v in self.sessions.items() if v['updated'] < cutoff and s not in self.sealing]:
+                try:
+                    os.remove(self._path(session_id))
+                except FileNotFoundError:
+                    pass
+                del self.sessions[session_id]
+                logging.warning(f"Upload session {session_id} expired without commit")
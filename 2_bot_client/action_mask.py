@@ -0,0 +1,42 @@
+import base64
+import numpy as np
+
+SLOTS = 4
+GRID = 24
+CELLS = GRID * GRID  # 576 positions per card slot
+
+class ActionMasker:
+    # Legal actions for one step as a bool mask over the action ids (slot * 576 + y * 24 + x,
+    # then wait): a slot is legal only while its card is affordable with the tracker's elixir,
+    # and then only on the cells its card type may be dropped on. Wait is always legal.
+    # cards: {name: {"elixir": cost, "spell": bool}} from the bot config.
+    # rows: {"troop": [first, last], "spell": [first, last]} inclusive grid rows (y, 0 = top of
+    # the screen) - troops and buildings go on our half, spells anywhere in the arena; the card
+    # bar and the top HUD are never targets. Defaults match the 720x1280 battle layout.
+    def __init__(self, cards, rows=None, action_size=SLOTS * CELLS + 1):
+        self.cards = cards or {}
+        rows = rows or {}
+        self.grids = {kind: self._grid(*rows.get(kind, default))
+                      for kind, default in (('troop', (11, 18)), ('spell', (1, 18)))}
+        self.action_size = action_size
+        self.wait_action = action_size - 1
+
+    @staticmethod
+    def _grid(first, last):
+        grid = np.zeros((GRID, GRID), dtype=bool)
+        grid[first:last + 1] = True
+        return grid.ravel()  # y * 24 + x, like the action ids
+
+    def mask(self, tracker):
+        hand, elixir = tracker.snapshot()
+        mask = np.zeros(self.action_size, dtype=bool)
+        for slot, name in enumerate(hand):
+            card = self.cards.get(name, {})
+            if card.get('elixir', 0) <= elixir:
+                mask[slot * CELLS:(slot + 1) * CELLS] = self.grids['spell' if card.get('spell') else 'troop']
+        mask[self.wait_action] = True
+        return mask
+
+def pack_mask(mask):
+    # Trajectory form: one bit per action (289 bytes for 2305 actions), base64 like the images
+    return base64.b64encode(np.packbits(mask).tobytes()).decode('utf-8')
@@ -0,0 +1,99 @@
+import time
+import queue
+import random
+import logging
+import threading
+import torch
+import numpy as np
+from metrics import REGISTRY
+
+BATCH_SIZE = REGISTRY.histogram('clash_bot_inference_batch_size', 'Frames per shared forward pass',
+                                buckets=(1, 2, 3, 4, 6, 8, 12, 16))
+
+class _Request:
+    __slots__ = ('frame', 'mask', 'action', 'error', 'done')
+
+    def __init__(self, frame, mask=None):
+        self.frame = frame
+        self.mask = mask
+        self.action = None
+        self.error = None
+        self.done = threading.Event()
+
+class BatchedInference:
+    # One model shared by every bot of a multi-emulator host. Each bot's pipeline calls
+    # predict_frame() from its own thread; a single service thread gathers pending frames
+    # until max_batch are waiting or max_wait_ms passed since the first one, then runs one
+    # batched forward pass and hands each caller its action. Drop-in for VisionAgent in
+    # GamePipeline/play_one_game (predict_frame, decode_action, model_version).
+    def __init__(self, agent, max_batch, max_wait_ms=10):
+        self.agent = agent
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.batch_tensor = torch.empty((max_batch, 1, 224, 128), dtype=torch.float32)  # Reused every batch
+        threading.Thread(target=self._run, name="batched-inference", daemon=True).start()
+
+    @property
+    def model_version(self):
+        return self.agent.model_version
+
+    def decode_action(self, action_id):
+        return self.agent.decode_action(action_id)
+
+    def predict_frame(self, frame, mask=None):
+        # frame: uint8 [224, 128], mask: optional bool [action_size]; blocks until the batch containing it has run
+        request = _Request(frame, mask)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.action
+
+    def _gather(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._gather()
+            try:
+                actions = self._infer(batch)
+                for request, action in zip(batch, actions):
+                    request.action = action
+            except Exception as e:
+                logging.error(f"Batched inference failed: {e}")
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+    def _infer(self, batch):
+        model = self.agent.model  # One read per batch, like VisionAgent.predict_frame
+        if model is None:
+            return [self.agent.random_action(request.mask) for request in batch]  # Random for initial
+        n = len(batch)
+        obs = self.batch_tensor[:n]
+        for i, request in enumerate(batch):
+            obs[i, 0].copy_(torch.from_numpy(request.frame))
+        obs.mul_(1.0 / 255.0)
+        masks = None
+        if any(request.mask is not None for request in batch):  # Unmasked callers: every action legal
+            masks = np.stack([request.mask if request.mask is not None else np.ones(self.agent.action_size, dtype=bool)
+                              for request in batch])
+        BATCH_SIZE.observe(n)
+        try:
+            actions = model.act(obs, deterministic=False, mask=masks)
+        except Exception as e:
+            logging.error(f"Inference failed: {e}")
+            if model is not self.agent.model or not self.agent.rollback():
+                raise
+            actions = self.agent.model.act(obs, deterministic=False, mask=masks)
+        return [actions] if n == 1 else actions  # act() returns an int for a single frame
@@ -1,13 +1,59 @@
+import threading
+
+START_ELIXIR = 5.0
+MAX_ELIXIR = 10.0
+ELIXIR_SECONDS = 2.8  # One elixir per 2.8s of battle time...
+DOUBLE_ELIXIR_AT = 120  # ...twice as fast in the last minute
+
 class CardTracker:
-    def __init__(self, deck):
+    # Hand cycle + estimated elixir for one battle. cards: {name: {"elixir": cost, "spell": bool}}
+    # from the bot config; a card missing there counts as free. The action thread plays cards while
+    # the inference thread reads the hand/elixir for the action mask, hence the lock.
+    def __init__(self, deck, cards=None):
         self.deck = deck
-        self.hand = deck[:4].copy()  # Current 4 cards
-        self.next_index = 4  # Cycle from deck[4:]
+        self.costs = {name: card.get('elixir', 0) for name, card in (cards or {}).items()}
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # New battle: starting hand and elixir
+        with self.lock:
+            self.hand = self.deck[:4].copy()  # Current 4 cards
+            self.next_index = 4  # Cycle from deck[4:]
+            self.elixir = START_ELIXIR
+            self.game_time = 0.0
+
+    @staticmethod
+    def _regenerated(game_time):
+        # Total elixir regenerated by game_time (seconds elapsed)
+        normal = min(game_time, DOUBLE_ELIXIR_AT)
+        return normal / ELIXIR_SECONDS + (game_time - normal) * 2 / ELIXIR_SECONDS
+
+    def update(self, game_time):
+        # Regenerate up to game_time; older times (a stale frame) change nothing
+        with self.lock:
+            if game_time > self.game_time:
+                gained = self._regenerated(game_time) - self._regenerated(self.game_time)
+                self.elixir = min(MAX_ELIXIR, self.elixir + gained)
+                self.game_time = game_time
+
+    def snapshot(self):
+        # (hand, elixir) read together, for the action mask
+        with self.lock:
+            return tuple(self.hand), self.elixir
+
+    def can_play(self, slot):
+        if slot is None:
+            return True  # Wait
+        with self.lock:
+            return self.costs.get(self.hand[slot], 0) <= self.elixir
 
     def card_played(self, slot):
         if slot is None:
             return None
-        played = self.hand[slot]
-        self.hand[slot] = self.deck[self.next_index % len(self.deck)]
-        self.next_index += 1
+        with self.lock:
+            played = self.hand[slot]
+            self.elixir = max(0.0, self.elixir - self.costs.get(played, 0))
+            self.hand[slot] = self.deck[self.next_index % len(self.deck)]
+            self.next_index += 1
         return played  # Logging only
@@ -0,0 +1,323 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import logging
+from collections import defaultdict
+from urllib.parse import urlparse
+import numpy as np
+import requests
+from game_interface import GameInterface
+from server_client import ServerClient
+from card_tracker import CardTracker
+from trajectory_uploader import StreamingUploader
+from main import play_one_game
+from metrics import Histogram
+
+# End-to-end load test: N simulated bots (threads running the real ServerClient, GamePipeline and
+# StreamingUploader code with a synthetic GameInterface and a random policy) against a server.py
+# started in a temp dir with the 'simulated' training backend. Reports per-endpoint latency
+# (client side and server side), ingest MB/s, lock contention, time-to-batch and training-cycle
+# time. --baseline compares against a stored run and exits 1 on a regression.
+#   python fleet_simulator.py --bots 50 --seconds 120 --game-seconds 20 --fps 2
+#   python fleet_simulator.py --save-baseline fleet_baseline.json
+#   python fleet_simulator.py --baseline fleet_baseline.json
+#   python fleet_simulator.py --url http://127.0.0.1:5000   # Existing server (its own backend)
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '1_central_server')
+LONG_POLL_ROUTES = ('/wait_for_play',)  # Latency is the wait itself: reported, never compared
+
+class SyntheticInterface(GameInterface):
+    # Games last game_seconds of wall time; frames are a fixed background with moving blocks,
+    # so they JPEG-encode to a realistic size (pure noise would not compress at all)
+    def __init__(self, device, game_seconds, action_delay=0.0, seed=0):
+        super().__init__(device)
+        self.game_seconds = game_seconds
+        self.action_delay = action_delay
+        self.rng = random.Random(seed)
+        ys, xs = np.mgrid[0:1280, 0:720]
+        self.background = np.stack([(xs * 255 // 720), (ys * 255 // 1280), np.full_like(xs, 96)], axis=-1).astype(np.uint8)
+        self.started = None
+        self.hp = None
+
+    def new_game(self):
+        self.started = time.monotonic()
+        self.hp = {'my_total': 6400, 'enemy_total': 6400, 'my_towers_down': 0, 'enemy_towers_down': 0}
+
+    def _elapsed(self):
+        return time.monotonic() - self.started if self.started is not None else 0.0
+
+    def capture_screenshot(self):
+        frame = self.background.copy()
+        for _ in range(8):  # Troops
+            x, y = self.rng.randrange(0, 680), self.rng.randrange(0, 1240)
+            frame[y:y + 40, x:x + 40] = self.rng.randrange(256)
+        return frame
+
+    def play_card(self, slot, x, y):
+        if slot is not None and self.action_delay:
+            time.sleep(self.action_delay)
+
+    def get_tower_hp(self):
+        for key in ('my_total', 'enemy_total'):
+            self.hp[key] = max(0, self.hp[key] - self.rng.randrange(0, 60))
+        return dict(self.hp)
+
+    def is_game_active(self):
+        return self.started is not None and self._elapsed() < self.game_seconds
+
+    def get_game_outcome(self):
+        return self.rng.choice(('win', 'loss', 'draw'))
+
+    def get_game_time(self):
+        return min(self._elapsed(), self.game_seconds)
+
+class RandomPolicy:
+    # Stands in for VisionAgent: no model, uniform actions, follows the server's model version
+    def __init__(self, action_size=2305):
+        self.action_size = action_size
+        self.model_version = 0
+
+    def predict_frame(self, frame, mask=None):
+        if mask is None:
+            return random.randrange(self.action_size)
+        return int(random.choice(np.flatnonzero(mask)))  # Legal actions only, like VisionAgent
+
+    def decode_action(self, action_id):
+        if action_id == self.action_size - 1:
+            return None, None, None
+        pos_id = action_id % 576
+        return action_id // 576, pos_id % 24, pos_id // 24
+
+class RequestStats:
+    # Client-side view of every request the simulated bots make: latency per route, bytes sent
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)  # {route: [seconds]}
+        self.sent_bytes = defaultdict(int)  # {route: request body bytes}
+        self.errors = defaultdict(int)
+
+    def hook(self, resp, *args, **kwargs):
+        route = re.sub(r'/game_session/(?!start$)[^/?]+', '/game_session/<id>', urlparse(resp.request.url).path)
+        body = resp.request.body
+        with self.lock:
+            self.latencies[route].append(resp.elapsed.total_seconds())
+            self.sent_bytes[route] += len(body) if body else 0
+            if resp.status_code >= 500:
+                self.errors[route] += 1
+
+    def summary(self):
+        with self.lock:
+            return {route: {
+                "requests": len(samples),
+                "errors": self.errors[route],
+                "p50_ms": _percentile(sorted(samples), 0.5),
+                "p95_ms": _percentile(sorted(samples), 0.95),
+                "p99_ms": _percentile(sorted(samples), 0.99)
+            } for route, samples in sorted(self.latencies.items())}
+
+def _percentile(samples, q):
+    if not samples:
+        return None
+    return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 3)
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_server(workdir, args):
+    # server.py in its own temp dir: every path in its config points inside workdir
+    config = json.load(open(os.path.join(SERVER_DIR, 'config.json')))
+    for key, default in (('state_snapshot_path', 'state_backup.json'), ('state_journal_path', 'state_journal.log'),
+                         ('game_store_dir', 'game_segments'), ('upload_session_dir', 'upload_sessions'),
+                         ('pending_batches_dir', 'pending_batches'), ('model_save_path', 'current_model.pth')):
+        config[key] = os.path.join(workdir, os.path.basename(config.get(key, default)))
+    config.update(host='127.0.0.1', port=_free_port(), kaggle_endpoint='simulated', replay_max_mb=0,
+                  simulated_training_seconds=args.training_seconds, event_ring_size=100000,
+                  batch_size=args.batch_size, batch_size_min=args.batch_size,
+                  safety_games=args.batch_size + max(1, args.bots // 2))
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen([sys.executable, os.path.join(SERVER_DIR, 'server.py')], cwd=workdir,
+                               stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{config['port']}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited, see {log.name}")
+        try:
+            requests.get(f"{url}/status", timeout=1)
+            return url, process
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Server did not start in 30s")
+
+def run_bot(index, url, args, config, stats, stop, workdir):
+    client = ServerClient(url, f"sim-{index}", 'binary', args.compression)
+    client.session.hooks['response'].append(stats.hook)
+    interface = SyntheticInterface(f"sim-{index}", args.game_seconds, args.action_delay, seed=index)
+    tracker = CardTracker(config['deck'], config.get('cards'))
+    policy = RandomPolicy(config['action_space_size'])
+    uploader = StreamingUploader(client, config.get('upload_chunk_steps', 10), os.path.join(workdir, f"spool_{index}"),
+                                 compression=args.compression)
+
+    def heartbeats():
+        while not stop.is_set():
+            state = interface.last_state
+            client.send_heartbeat("playing" if state is not None and state.active else "waiting",
+                                  state.progress if state is not None else 0.0)
+            stop.wait(args.heartbeat_seconds)
+    time.sleep(random.uniform(0, args.heartbeat_seconds))  # Stagger the fleet
+    threading.Thread(target=heartbeats, daemon=True).start()
+    while not stop.is_set():
+        result = client.wait_for_play(policy.model_version, args.long_poll_seconds)
+        policy.model_version = max(policy.model_version, result.get('current_model_version') or 0)  # "Swap" instantly
+        if result['allowed'] and not stop.is_set():
+            interface.new_game()
+            play_one_game(client, policy, interface, tracker, config, uploader)
+
+def scrape(url):
+    resp = requests.get(f"{url}/metrics", params={"format": "json"}, timeout=10)
+    return resp.json() if resp.status_code == 200 else []
+
+def server_latency(exported):
+    result = {}
+    for m in exported:
+        if m['name'] == 'clash_http_request_seconds' and m['count']:
+            histogram = Histogram.from_export(m)
+            result[m['labels']['route']] = {"requests": m['count'],
+                                            **{f"p{int(q * 100)}_ms": round(histogram.quantile(q) * 1000, 3)
+                                               for q in (0.5, 0.95, 0.99)}}
+    return dict(sorted(result.items()))
+
+def lock_contention(exported):
+    locks = defaultdict(dict)
+    for m in exported:
+        if m['name'].startswith('clash_lock_') and 'lock' in m['labels']:
+            locks[m['labels']['lock']][m['name']] = m
+    result = {}
+    for name, ms in sorted(locks.items()):
+        total = ms.get('clash_lock_acquisitions_total', {}).get('value', 0)
+        contended = ms.get('clash_lock_contended_total', {}).get('value', 0)
+        wait = ms.get('clash_lock_wait_seconds')
+        result[name] = {
+            "acquisitions": total,
+            "contended_fraction": round(contended / total, 5) if total else None,
+            "wait_total_ms": round(wait['sum'] * 1000, 3) if wait else 0.0,
+            "wait_p99_ms": round(Histogram.from_export(wait).quantile(0.99) * 1000, 3) if wait and wait['count'] else None
+        }
+    return result
+
+def training_timeline(url, started):
+    # From the server's event feed: when each batch was handed to training and how long cycles took
+    events = requests.get(f"{url}/ui/data", params={"since": 0}, timeout=10).json()['events']
+    starts = [e['time'] for e in events if e['kind'] == 'training_started']
+    published = [e['time'] for e in events if e['kind'] == 'model_published']
+    durations = [e['seconds'] for e in events if e['kind'] == 'training_finished']
+    games = [e for e in events if e['kind'] == 'game_received']
+
+    def mean(values):
+        return round(sum(values) / len(values), 2) if values else None
+    return {
+        "games_received": len(games),
+        "batches_started": len(starts),
+        "time_to_first_batch_seconds": round(starts[0] - started, 2) if starts else None,
+        "time_between_batches_seconds": mean([b - a for a, b in zip(starts, starts[1:])]),
+        "training_seconds": mean(durations),
+        "model_cycle_seconds": mean([b - a for a, b in zip(published, published[1:])]),
+        "models_published": len(published)
+    }
+
+def compare(result, baseline, tolerance, min_requests=50):
+    # Regressions: slower server-side handling or lower ingest/game throughput. Compared on p50
+    # of routes with enough requests: tails swing several-fold between identical runs (games
+    # ending together, the simulator sharing the CPU), so they are reported but not gated
+    regressions = []
+    if baseline.get('args') != result['args']:
+        logging.warning("Baseline was recorded with different arguments - comparison is approximate")
+    for route, base in baseline['server_latency'].items():
+        now = result['server_latency'].get(route)
+        if route in LONG_POLL_ROUTES or not now or base['requests'] < min_requests or not base.get('p50_ms'):
+            continue
+        if now['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{route} p50 {now['p50_ms']}ms > baseline {base['p50_ms']}ms")
+    for key in ('ingest_mb_per_second', 'games_per_minute'):
+        if baseline.get(key) and result[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key} {result[key]} < baseline {baseline[key]}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bots', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--game-seconds', type=float, default=15)
+    parser.add_argument('--fps', type=float, default=2.0)
+    parser.add_argument('--action-delay', type=float, default=0.0)
+    parser.add_argument('--heartbeat-seconds', type=float, default=10.0)
+    parser.add_argument('--long-poll-seconds', type=float, default=25.0)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--training-seconds', type=float, default=5.0)
+    parser.add_argument('--compression', default='zstd')
+    parser.add_argument('--url', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--save-baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=1.0)  # 1.0: flag 2x slower
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)  # main.py configured INFO: one line per simulated game
+
+    workdir = tempfile.mkdtemp(prefix='fleet_sim_')
+    url, process = (args.url.rstrip('/'), None) if args.url else start_server(workdir, args)
+    config = json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')))
+    config['frame_interval_seconds'] = 1.0 / args.fps
+    stats = RequestStats()
+    stop = threading.Event()
+    started = time.time()
+    bots = [threading.Thread(target=run_bot, args=(i, url, args, config, stats, stop, workdir), daemon=True)
+            for i in range(args.bots)]
+    try:
+        for t in bots:
+            t.start()
+        stop.wait(args.seconds)
+        stop.set()
+        elapsed = time.time() - started
+        exported = scrape(url)
+        timeline = training_timeline(url, started)
+    finally:
+        stop.set()
+        logging.disable(logging.ERROR)  # Bots still long-polling see the server go away
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+    upload_routes = ('/game_complete', '/game_session/<id>/chunk')
+    result = {
+        "args": {k: v for k, v in vars(args).items() if k not in ('url', 'baseline', 'save_baseline', 'tolerance')},
+        "duration_seconds": round(elapsed, 1),
+        "ingest_mb_per_second": round(sum(stats.sent_bytes[r] for r in upload_routes) / elapsed / 1e6, 3),
+        "games_per_minute": round(timeline['games_received'] / elapsed * 60, 2),
+        "client_latency": stats.summary(),
+        "server_latency": server_latency(exported),
+        "lock_contention": lock_contention(exported),
+        "training": timeline
+    }
+    print(json.dumps(result, indent=2))
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        regressions = compare(result, json.load(open(args.baseline)), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION: {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import cv2
+import numpy as np
+
+class FrameDedup:
+    # Flags frames that repeat the last unique one (idle stretches at a fixed frame interval).
+    # Compares a 16x28 area-averaged thumbnail against the last unique frame's - not the previous
+    # frame's, so slow changes can't creep past the threshold one small step at a time.
+    # threshold: mean absolute difference in gray levels (0-255) still counted as the same frame;
+    # the default sits well under JPEG Q40's own error, so the trainer sees nothing it wouldn't anyway.
+    def __init__(self, threshold=1.0):
+        self.threshold = threshold
+        self.unique_thumb = None
+        self.unique_step = None
+
+    def check(self, gray, step):
+        # Returns the step number of the frame this one repeats, or None (step becomes the new unique frame)
+        thumb = cv2.resize(gray, (16, 28), interpolation=cv2.INTER_AREA).astype(np.int16)
+        if self.unique_thumb is not None and np.abs(thumb - self.unique_thumb).mean() <= self.threshold:
+            return self.unique_step
+        self.unique_thumb = thumb
+        self.unique_step = step
+        return None
@@ -3,12 +3,27 @@
 import random
 import time
 import logging
+from game_state import GameState
 
 class GameInterface:
-    def __init__(self):
-        # self.reader = StateReader(device='emulator-5554')  # Per BuildABot
-        # self.executor = ActionExecutor(device='emulator-5554')
+    def __init__(self, device='emulator-5554'):
+        self.device = device  # ADB serial - one GameInterface per emulator
+        # self.reader = StateReader(device=device)  # Per BuildABot
+        # self.executor = ActionExecutor(device=device)
         self.prev_tower_hp = {'my_total': 6400, 'enemy_total': 6400, 'my_towers_down': 0, 'enemy_towers_down': 0}  # King+2 towers
+        self.last_state = None  # Newest GameState - heartbeats read it instead of the emulator
+
+    def capture_state(self):
+        # One screen grab per step; HP, time, battle flag and outcome are parsed from that same image
+        # instead of a separate ADB round-trip each (those dominate step latency on real devices)
+        # screenshot = self.reader.get_screenshot()
+        # hp = self.reader.get_tower_health(screenshot); time = self.reader.get_battle_time(screenshot) ...
+        screenshot = self.capture_screenshot()
+        active = self.is_game_active()
+        state = GameState(screenshot, self.get_tower_hp(), self.get_game_time(), active,
+                          outcome=None if active else self.get_game_outcome())
+        self.last_state = state
+        return state
 
     def capture_screenshot(self):
         # return self.reader.get_screenshot()  # np.array BGR, fixed 720x1280
@@ -48,8 +63,9 @@ class GameInterface:
         # Mock for testing
         return 120
 
-    def calculate_reward(self):
-        current = self.get_tower_hp()
+    def calculate_reward(self, state=None):
+        # state: newest GameState (no extra HP read); None reads the emulator
+        current = state.tower_hp if state is not None else self.get_tower_hp()
         reward = 0.0
         enemy_dmg = self.prev_tower_hp['enemy_total'] - current['enemy_total']
         reward += enemy_dmg * 0.01
@@ -0,0 +1,231 @@
+import time
+import queue
+import threading
+import logging
+from collections import deque
+from image_utils import encode_frame
+from metrics import REGISTRY, Histogram, FRAME_BUCKETS
+from frame_dedup import FrameDedup
+from action_mask import pack_mask
+
+DROPPED_FRAMES = REGISTRY.counter('clash_bot_dropped_frames_total', 'Captured frames skipped as stale')
+DEDUPLICATED_FRAMES = REGISTRY.counter('clash_bot_deduplicated_frames_total', 'Steps stored as a reference to an earlier frame')
+STALE_MASK_WAITS = REGISTRY.counter('clash_bot_stale_mask_waits_total', 'Sampled plays turned into waits: the elixir went to the action before')
+
+class FrameRing:
+    # Bounded ring of captured frames. The capture thread never blocks (the oldest frame is
+    # overwritten); inference always takes the freshest frame and skips anything older.
+    def __init__(self, capacity=2):
+        self.frames = deque(maxlen=capacity)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self.cond:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(frame)
+            self.cond.notify()
+
+    def take_latest(self):
+        # Returns None once closed and empty (game over)
+        with self.cond:
+            while not self.frames and not self.closed:
+                self.cond.wait()
+            if not self.frames:
+                return None
+            frame = self.frames.pop()
+            self.dropped += len(self.frames)
+            self.frames.clear()
+            return frame
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class StageStats:
+    # Per-stage latencies (seconds) for one game in fixed-bucket histograms - no per-sample
+    # storage on the frame path. Each sample also feeds the process-wide
+    # clash_bot_stage_seconds histograms pushed with the heartbeat. summary() is what gets
+    # logged and uploaded (percentiles are bucket estimates).
+    STAGES = ('capture', 'preprocess', 'encode', 'infer', 'queue_wait', 'decision_to_action',
+              'frame_age_at_action', 'act', 'reward')
+
+    def __init__(self):
+        self.game = {stage: Histogram(FRAME_BUCKETS) for stage in self.STAGES}
+        self.total = {stage: REGISTRY.histogram('clash_bot_stage_seconds', 'Per-frame pipeline stage time',
+                                                {'stage': stage}, FRAME_BUCKETS) for stage in self.STAGES}
+
+    def add(self, stage, seconds):
+        self.game[stage].observe(seconds)
+        self.total[stage].observe(seconds)
+
+    def summary(self):
+        result = {}
+        for stage, hist in self.game.items():
+            if not hist.count:
+                continue
+            result[stage] = {
+                "n": hist.count,
+                "p50_ms": round(hist.quantile(0.5) * 1000, 1),
+                "p95_ms": round(hist.quantile(0.95) * 1000, 1),
+                "max_ms": round(hist.max * 1000, 1)
+            }
+        return result
+
+class GamePipeline:
+    # One game as four overlapping stages instead of one sequential loop:
+    #   capture thread : GameState snapshot + grayscale/resize every frame_interval -> FrameRing
+    #   main thread    : freshest raw frame (+ legal-action mask) -> predict_frame -> action queue (max 1 pending action)
+    #   action thread  : card tracker + play_card (human-like delay) + reward from the newest snapshot
+    #   writer thread  : dedup + JPEG encode + step dict -> sink (uploader.add_step or list.append), in order
+    # so capture, encoding and the 0.5-2s play_card delay no longer hold up the next decision.
+    # dedup_threshold: frames matching the last unique one are stored as an image_ref to its
+    # step instead of another JPEG (see FrameDedup); None stores every frame.
+    # masker: ActionMasker - the policy only samples actions the tracker's hand and elixir allow,
+    # and each step records its mask ("action_mask") for the trainer; None samples every action.
+    def __init__(self, agent, interface, tracker, frame_interval, sink, ring_size=2, dedup_threshold=None,
+                 masker=None):
+        self.agent = agent
+        self.interface = interface
+        self.tracker = tracker
+        self.frame_interval = frame_interval
+        self.sink = sink
+        self.ring = FrameRing(ring_size)
+        self.actions = queue.Queue(maxsize=1)
+        self.steps = queue.Queue()
+        self.stats = StageStats()
+        self.dedup = FrameDedup(dedup_threshold) if dedup_threshold is not None else None
+        self.deduplicated = 0
+        self.masker = masker
+        self.stale_mask_waits = 0
+        self.step_count = 0
+        self.last_time = 0
+        self.latest_state = None  # Newest GameState (reward source)
+        self.final_state = None  # Snapshot that saw the battle end (outcome), None if capture failed
+
+    def run(self):
+        threads = [threading.Thread(target=self._capture_loop, name="capture", daemon=True),
+                   threading.Thread(target=self._action_loop, name="action", daemon=True),
+                   threading.Thread(target=self._writer_loop, name="writer", daemon=True)]
+        for t in threads:
+            t.start()
+        self._inference_loop()
+        for t in threads:
+            t.join()
+        DROPPED_FRAMES.inc(self.ring.dropped)
+        if self.ring.dropped:
+            logging.info(f"Pipeline skipped {self.ring.dropped} stale frames")
+        return self.step_count
+
+    def _capture_loop(self):
+        next_tick = time.monotonic()
+        try:
+            while True:
+                delay = next_tick - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_tick = max(next_tick + self.frame_interval, time.monotonic())
+                t0 = time.perf_counter()
+                state = self.interface.capture_state()  # One screen read for frame, HP, time and battle flag
+                t1 = time.perf_counter()
+                self.latest_state = state
+                self.stats.add('capture', t1 - t0)
+                if not state.active:
+                    self.final_state = state
+                    break
+                gray = state.gray
+                self.stats.add('preprocess', time.perf_counter() - t1)
+                self.ring.put({"captured_at": t0, "time": state.game_time, "gray": gray})
+        except Exception as e:
+            logging.error(f"Capture failed, ending game: {e}")
+        finally:
+            self.ring.close()
+
+    def _inference_loop(self):
+        try:
+            self._infer_frames()
+        finally:
+            self.actions.put(None)  # Lets the action and writer threads drain and exit
+
+    def _infer_frames(self):
+        while True:
+            frame = self.ring.take_latest()
+            if frame is None:
+                break
+            t1 = time.perf_counter()
+            mask = None
+            if self.masker is not None:
+                self.tracker.update(frame["time"])
+                mask = self.masker.mask(self.tracker)
+            frame["mask"] = mask
+            frame["action"] = self.agent.predict_frame(frame["gray"], mask)  # Exact pixels, no JPEG round-trip
+            t2 = time.perf_counter()
+            frame["decided_at"] = t2
+            self.actions.put(frame)  # Blocks only while a previous action is still pending
+            self.stats.add('infer', t2 - t1)
+            self.stats.add('queue_wait', time.perf_counter() - t2)
+
+    def _action_loop(self):
+        while True:
+            item = self.actions.get()
+            if item is None:
+                break
+            t0 = time.perf_counter()
+            slot, x, y = self.agent.decode_action(item["action"])
+            if self.masker is not None:
+                self.tracker.update(self.latest_state.game_time)  # Elixir regenerated since the decision
+            if self.masker is not None and not self.tracker.can_play(slot):
+                # Decided while the previous action was still pending; its card took the elixir
+                slot = x = y = None
+                item["action"] = self.masker.wait_action
+                self.stale_mask_waits += 1
+                STALE_MASK_WAITS.inc()
+            card_name = self.tracker.card_played(slot)
+            self.interface.play_card(slot, x, y)
+            t1 = time.perf_counter()
+            item["reward"] = self.interface.calculate_reward(self.latest_state)  # HP as of the newest capture
+            t2 = time.perf_counter()
+            played = slot is not None
+            item["action_details"] = {"type": "play_card" if played else "wait", "slot": slot, "card": card_name,
+                                      "position": {"x": x, "y": y} if played else None,
+                                      "decision_to_action_ms": round((t0 - item["decided_at"]) * 1000, 1)}
+            self.stats.add('decision_to_action', t0 - item["decided_at"])
+            self.stats.add('frame_age_at_action', t0 - item["captured_at"])
+            self.stats.add('act', t1 - t0)
+            self.stats.add('reward', t2 - t1)
+            self.steps.put(item)
+        self.steps.put(None)
+
+    def _writer_loop(self):
+        while True:
+            item = self.steps.get()
+            if item is None:
+                break
+            t0 = time.perf_counter()
+            ref = self.dedup.check(item["gray"], self.step_count) if self.dedup is not None else None
+            if ref is None:
+                compressed = encode_frame(item["gray"])  # Trajectory copy, off the decision path
+            else:
+                compressed = {"data": "", "shape": list(item["gray"].shape)}  # Server/loader resolve image_ref
+                self.deduplicated += 1
+                DEDUPLICATED_FRAMES.inc()
+            self.stats.add('encode', time.perf_counter() - t0)
+            step = {
+                "step": self.step_count,
+                "time": item["time"],
+                "image": compressed['data'],
+                "image_shape": compressed['shape'],
+                "action": item["action"],
+                "action_details": item["action_details"],
+                "reward": item["reward"]
+            }
+            if ref is not None:
+                step["image_ref"] = ref
+            if item["mask"] is not None:
+                step["action_mask"] = pack_mask(item["mask"])
+            self.sink(step)
+            self.step_count += 1
+            self.last_time = item["time"]
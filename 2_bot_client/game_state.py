@@ -0,0 +1,32 @@
+import time
+from types import MappingProxyType
+from image_utils import preprocess_screenshot
+
+class GameState:
+    # Everything the bot knows about one step, read from a single screen capture: the raw BGR
+    # frame, tower HP, game time, whether the battle is still on and the outcome once it is not.
+    # Immutable, so the capture, action and heartbeat threads can share it without locking.
+    # The preprocessed frame (gray) is computed on first use and cached.
+    __slots__ = ('frame', 'tower_hp', 'game_time', 'active', 'outcome', 'captured_at', '_gray')
+
+    def __init__(self, frame, tower_hp, game_time, active, outcome=None, captured_at=None):
+        fields = {'frame': frame, 'tower_hp': MappingProxyType(dict(tower_hp)), 'game_time': game_time, 'active': active,
+                  'outcome': outcome, 'captured_at': captured_at or time.perf_counter(), '_gray': None}
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+        if frame is not None:
+            frame.flags.writeable = False
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GameState is immutable")
+
+    @property
+    def gray(self):
+        # uint8 [224, 128] model input / trajectory image, preprocessed once
+        if self._gray is None:
+            object.__setattr__(self, '_gray', preprocess_screenshot(self.frame))
+        return self._gray
+
+    @property
+    def progress(self):
+        return self.game_time / 180.0  # Normalize to 1 (3 minute battle)
@@ -3,20 +3,36 @@ import base64
 import numpy as np
 import logging
 
-def compress_screenshot(screenshot_bgr):
-    # Input: np.array BGR from BuildABot (720x1280)
+def preprocess_screenshot(screenshot_bgr):
+    # Input: np.array BGR from BuildABot (720x1280) -> uint8 grayscale [224, 128]
     gray = cv2.cvtColor(screenshot_bgr, cv2.COLOR_BGR2GRAY)  # Grayscale
     height, width = 224, 128  # Fixed, aspect preserved (720/1280 ~0.5625, 224*0.5625~126, round to 128)
-    resized = cv2.resize(gray, (width, height))
+    return cv2.resize(gray, (width, height))
+
+def encode_frame(resized):
+    # Preprocessed [224, 128] frame -> trajectory format (JPEG Q=40, base64)
     encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 40]
     _, buffer = cv2.imencode('.jpg', resized, encode_param)
     img_base64 = base64.b64encode(buffer).decode('utf-8')
-    return {"data": img_base64, "shape": [height, width]}
+    return {"data": img_base64, "shape": list(resized.shape)}
+
+def prepare_frame(screenshot_bgr):
+    # One preprocessing pass for both consumers: raw uint8 frame for the model (exact pixels,
+    # no JPEG artifacts) and the encoded dict for the trajectory
+    resized = preprocess_screenshot(screenshot_bgr)
+    return resized, encode_frame(resized)
+
+def compress_screenshot(screenshot_bgr):
+    return encode_frame(preprocess_screenshot(screenshot_bgr))
+
+def decode_jpeg(buffer):
+    # Raw JPEG bytes -> uint8 grayscale (cv2 releases the GIL, safe to run in a thread pool)
+    nparr = np.frombuffer(buffer, np.uint8)
+    return cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
 
 def decompress_image(compressed_dict):
     data = compressed_dict['data']
     shape = compressed_dict['shape']
     buffer = base64.b64decode(data)
-    nparr = np.frombuffer(buffer, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_GRAYSCALE)
+    img = decode_jpeg(buffer)
     return img  # For predict
@@ -0,0 +1,102 @@
+import os
+import time
+import zipfile
+import logging
+import torch
+import torch.nn as nn
+
+class PolicyNet(nn.Module):
+    # Just the acting path of the SB3 ActorCriticCnnPolicy: ClashCNN features -> actor MLP -> action logits.
+    # Input is already normalized to [0, 1] by VisionAgent, so SB3's obs preprocessing is skipped.
+    def __init__(self, policy):
+        super().__init__()
+        self.features = getattr(policy, 'pi_features_extractor', None) or policy.features_extractor
+        self.actor = policy.mlp_extractor.policy_net
+        self.action_net = policy.action_net
+
+    def forward(self, obs):
+        return self.action_net(self.actor(self.features(obs)))
+
+def load_policy(model_path):
+    # SB3 .zip from train_ppo (model.save) or a pickled policy/module from torch.save. torch.save
+    # writes zip archives too: only SB3's have a top-level 'data' entry
+    if zipfile.is_zipfile(model_path) and 'data' in zipfile.ZipFile(model_path).namelist():
+        # Policy weights only, not PPO.load: the server's fp16 variant leaves out the optimizer
+        # state, which PPO.load insists on. load_state_dict casts fp16 weights back to float32
+        from stable_baselines3.common.save_util import load_from_zip_file
+        data, params, _ = load_from_zip_file(model_path, device='cpu')
+        policy = data['policy_class'](data['observation_space'], data['action_space'], lambda _: 0.0,
+                                      **data['policy_kwargs'])
+        policy.load_state_dict(params['policy'])
+        return policy
+    loaded = torch.load(model_path, map_location='cpu', weights_only=False)
+    return getattr(loaded, 'policy', loaded)
+
+def configure_threads(threads=None):
+    # The emulator shares the VM's cores: by default use half of them for intra-op work
+    threads = threads or max(1, (os.cpu_count() or 2) // 2)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)  # Only allowed before the first parallel op
+    except RuntimeError:
+        pass
+    return threads
+
+class InferenceEngine:
+    # Loads the policy once into an eval-only, optimized module and warms it up so the first
+    # real frame is not the slow one. compile_mode: 'trace' (TorchScript trace + freeze),
+    # 'compile' (torch.compile, needs a C++ toolchain) or 'none'. quantize=True applies dynamic
+    # int8 quantization to the big Linear(18432, 512) layer, the bulk of the weights and FLOPs.
+    def __init__(self, model_path, threads=None, quantize=False, compile_mode='trace', warmup=20,
+                 input_shape=(1, 1, 224, 128)):
+        self.model_path = model_path
+        self.threads = configure_threads(threads)
+        self.input_shape = input_shape
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(model_path)
+        policy = load_policy(model_path)
+        net = PolicyNet(policy).eval() if hasattr(policy, 'action_net') else policy.eval()
+        if quantize:
+            big_linears = {name for name, m in net.named_modules() if isinstance(m, nn.Linear) and m.in_features >= 4096}
+            net = torch.ao.quantization.quantize_dynamic(net, big_linears, dtype=torch.qint8)
+        example = torch.zeros(input_shape)
+        if compile_mode == 'trace':
+            with torch.no_grad():
+                net = torch.jit.freeze(torch.jit.trace(net, example))
+        elif compile_mode == 'compile':
+            net = torch.compile(net, mode='reduce-overhead')
+        self.net = net
+        self.latency = self.benchmark(example, warmup) if warmup else None
+        logging.info(f"Inference engine ready ({compile_mode}, int8={quantize}, threads={self.threads}), "
+                     f"latency p50 {self.latency['p50_ms'] if self.latency else '?'}ms "
+                     f"p99 {self.latency['p99_ms'] if self.latency else '?'}ms")
+
+    def benchmark(self, example, n):
+        # Warm-up passes double as the startup latency report (sizing VMs)
+        timings = []
+        with torch.inference_mode():
+            for _ in range(n):
+                t0 = time.perf_counter()
+                self.net(example)
+                timings.append(time.perf_counter() - t0)
+        timings = sorted(timings[1:] or timings)  # First call pays one-off setup
+        return {
+            "p50_ms": round(timings[len(timings) // 2] * 1000, 2),
+            "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000, 2)
+        }
+
+    def logits(self, obs):
+        with torch.inference_mode():
+            return self.net(obs)
+
+    def act(self, obs, deterministic=False, mask=None):
+        # obs: [N, 1, 224, 128] float in [0, 1] -> action ids (int for N == 1)
+        # mask: optional bool [A] or [N, A] legal actions - the rest get zero probability
+        logits = self.logits(obs)
+        if mask is not None:
+            logits = logits.masked_fill(~torch.as_tensor(mask), float('-inf'))
+        if deterministic:
+            actions = logits.argmax(dim=-1)
+        else:
+            actions = torch.multinomial(torch.softmax(logits, dim=-1), 1).squeeze(-1)
+        return int(actions[0]) if actions.shape[0] == 1 else actions.tolist()
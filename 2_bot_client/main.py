@@ -1,4 +1,5 @@
 import time
+import socket
 import threading
 import logging
 from json import load as json_load
@@ -6,80 +7,121 @@ from vision_agent import VisionAgent
 from game_interface import GameInterface
 from server_client import ServerClient
 from card_tracker import CardTracker
-from image_utils import compress_screenshot
+from game_pipeline import GamePipeline
+from trajectory_uploader import StreamingUploader
+from model_updater import ModelUpdater
+from metrics import REGISTRY
+from batched_inference import BatchedInference
+from action_mask import ActionMasker
 
 logging.basicConfig(level=logging.INFO)
 
-def heartbeat_thread(client, interface):
+def heartbeat_thread(client, interface, updater, push_metrics=True):
+    # push_metrics: metrics are per process - on a multi-emulator host only one bot sends them
     while True:
-        status = "playing" if interface.is_game_active() else "waiting"
-        progress = interface.get_game_time() / 180.0  # Normalize to 1
-        client.send_heartbeat(status, progress)
+        state = interface.last_state  # Newest in-game snapshot: no emulator read just for the heartbeat
+        status = "playing" if state is not None and state.active else "waiting"
+        progress = state.progress if state is not None else 0.0
+        metrics = REGISTRY.export() if push_metrics else None  # Cumulative, server exposes on /metrics
+        resp = client.send_heartbeat(status, progress, metrics)
+        if resp:
+            updater.notify(resp.get('server_status'))  # New models noticed mid-game without extra requests
         time.sleep(10)
 
-def play_one_game(client, agent, interface, tracker, config):
+def play_one_game(client, agent, interface, tracker, config, uploader=None):
+    # uploader: StreamingUploader streams steps during the game; None = one upload at the end
     trajectory = []
-    last_frame = 0
     metadata = {"duration_seconds": 0, "outcome": "draw", "final_crowns": {"mine": 0, "enemy": 0}}
+    metadata["model_version"] = agent.model_version  # Before the game: a hot swap mid-game doesn't relabel it
     interface.prev_tower_hp = {'my_total': 6400, 'enemy_total': 6400, 'my_towers_down': 0, 'enemy_towers_down': 0}  # Reset
+    tracker.reset()  # Starting hand and elixir
+    masker = None
+    if config.get('action_masking', True):  # false: sample all actions, record no masks
+        masker = ActionMasker(config.get('cards'), config.get('placement_rows'), config['action_space_size'])
+    if uploader is not None:
+        uploader.start_game()
 
-    while interface.is_game_active():
-        current_time = interface.get_game_time()
-        metadata["duration_seconds"] = current_time
-
-        if current_time - last_frame >= config['frame_interval_seconds']:
-            screenshot = interface.capture_screenshot()
-            compressed = compress_screenshot(screenshot)
-            action_id = agent.predict(compressed)
-            slot, x, y = agent.decode_action(action_id)
-            card_name = tracker.card_played(slot)
-            interface.play_card(slot, x, y)
-            reward = interface.calculate_reward()
-            action_details = {"type": "play_card" if slot else "wait", "slot": slot, "card": card_name, "position": {"x": x, "y": y} if slot else None}
-            trajectory.append({
-                "step": len(trajectory),
-                "time": current_time,
-                "image": compressed['data'],
-                "image_shape": compressed['shape'],
-                "action": action_id,
-                "action_details": action_details,
-                "reward": reward
-            })
-            last_frame = current_time
+    # Capture / inference / action / trajectory writing run as overlapping stages
+    sink = uploader.add_step if uploader is not None else trajectory.append  # Bounded memory when streaming
+    pipeline = GamePipeline(agent, interface, tracker, config['frame_interval_seconds'], sink,
+                            ring_size=config.get('frame_ring_size', 2),
+                            dedup_threshold=config.get('frame_dedup_threshold', 1.0),  # null: store every frame
+                            masker=masker)
+    steps = pipeline.run()
+    metadata["duration_seconds"] = pipeline.last_time
+    metadata["latency_ms"] = pipeline.stats.summary()
+    metadata["deduplicated_frames"] = pipeline.deduplicated
+    metadata["stale_mask_waits"] = pipeline.stale_mask_waits
 
     # End game
-    outcome = interface.get_game_outcome()
+    final_state = pipeline.final_state
+    outcome = final_state.outcome if final_state is not None else interface.get_game_outcome()
     final_reward = 100 if outcome == "win" else (-100 if outcome == "loss" else 0)
-    if len(trajectory) > 0:
-        trajectory[-1]['reward'] += final_reward  # Add to last step
     metadata["outcome"] = outcome
-    client.send_game_complete(trajectory, metadata)
-    logging.info(f"Game complete: {outcome}, steps: {len(trajectory)}")
+    if uploader is not None:
+        uploader.finish(metadata, final_reward)  # Added to last step, then commit
+    else:
+        if len(trajectory) > 0:
+            trajectory[-1]['reward'] += final_reward  # Add to last step
+        client.send_game_complete(trajectory, metadata)
+    latency = metadata["latency_ms"]
+    logging.info(f"Game complete: {outcome}, steps: {steps}, "
+                 f"infer p50 {latency.get('infer', {}).get('p50_ms')}ms, "
+                 f"decision->action p50 {latency.get('decision_to_action', {}).get('p50_ms')}ms")
     return trajectory
 
+def bot_loop(client, agent, interface, tracker, config, uploader, updater):
+    seen_version = agent.model_version  # Newest version the server told us about (may still be downloading)
+    while True:
+        # Long-poll: the server answers as soon as we get a slot or a newer model is published
+        result = client.wait_for_play(max(seen_version, agent.model_version), config.get('long_poll_seconds', 25))
+        seen_version = max(seen_version, result.get('current_model_version') or 0)
+        updater.notify(result)  # Download + swap happen in the background
+        if result['allowed']:
+            logging.info(f"[{interface.device}] Playing game: {result['reason']}")
+            play_one_game(client, agent, interface, tracker, config, uploader)
+        else:
+            logging.info(f"[{interface.device}] Waiting: {result['reason']}")
+
 if __name__ == '__main__':
     config = json_load(open('config.json'))
-    client = ServerClient(config['server_url'])
-    agent = VisionAgent(config['model_path'])
-    interface = GameInterface()
-    tracker = CardTracker(config['deck'])
+    agent = VisionAgent(config['model_path'], config['action_space_size'], engine_options={
+        "threads": config.get('inference_threads'),
+        "quantize": config.get('inference_quantize', False),
+        "compile_mode": config.get('inference_compile', 'trace'),
+        "warmup": config.get('inference_warmup', 20)
+    })
+    # One process can drive several emulators: each gets its own GameInterface, CardTracker,
+    # server identity and upload spool; the model is loaded once and shared
+    devices = config.get('emulators') or ['emulator-5554']
+    policy = agent
+    if len(devices) > 1:
+        policy = BatchedInference(agent, max_batch=len(devices), max_wait_ms=config.get('inference_batch_wait_ms', 10))
+    host = config.get('bot_id') or socket.gethostname()  # Bot id prefix, shared by this host's emulators
+    updater = None
+    bots = []
+    for i, device in enumerate(devices):
+        client = ServerClient(config['server_url'], f"{host}-{device}",
+                              config.get('upload_format', 'binary'), config.get('upload_compression', 'zstd'))
+        if updater is None:
+            updater = ModelUpdater(client, agent, config.get('model_poll_seconds', 300),
+                                   config.get('model_variant', 'full'))  # Hot swaps, never blocks play
+        interface = GameInterface(device)
+        tracker = CardTracker(config['deck'], config.get('cards'))
+        uploader = None
+        if config.get('upload_mode', 'stream') == 'stream':
+            uploader = StreamingUploader(client, config.get('upload_chunk_steps', 10),
+                                         spool_dir='upload_spool' if len(devices) == 1 else f'upload_spool_{i}',
+                                         compression=config.get('upload_compression', 'zstd'))
 
-    # Start heartbeat thread
-    heartbeat_t = threading.Thread(target=heartbeat_thread, args=(client, interface), daemon=True)
-    heartbeat_t.start()
-
-    while True:
-        allowed, reason = client.can_i_play()
-        if allowed:
-            logging.info(f"Playing game: {reason}")
-            play_one_game(client, agent, interface, tracker, config)
-        else:
-            status = client.get_status()
-            if status['update_available']:
-                if client.download_model(config['model_path']):
-                    agent.load_model()
-                    logging.info("Updated to new model")
-            logging.info(f"Waiting: {reason}")
-            time.sleep(5)  # Poll interval
+        # Start heartbeat thread
+        heartbeat_t = threading.Thread(target=heartbeat_thread, args=(client, interface, updater, i == 0), daemon=True)
+        heartbeat_t.start()
+        bots.append(threading.Thread(target=bot_loop, name=f"bot-{device}", daemon=True,
+                                     args=(client, policy, interface, tracker, config, uploader, updater)))
+    for t in bots:
+        t.start()
+    for t in bots:
+        t.join()
 
 # Edge: Mid-game pause - Check is_game_active() before frame; if pause signal from status, finish if progress>0.5 else abort (rare). Crash: Thread safe, restart script reloads last model.
@@ -0,0 +1,93 @@
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import threading
+import numpy as np
+import torch
+import torch.nn as nn
+from gymnasium import spaces
+from image_utils import preprocess_screenshot, encode_frame, compress_screenshot, prepare_frame, decompress_image
+from vision_agent import VisionAgent
+from batched_inference import BatchedInference
+from model import ClashCNN
+from benchmark_utils import synthetic_screenshots, measure, report
+
+# Bot-side hot paths on synthetic 720x1280 BGR frames: preprocessing, JPEG encode/decode,
+# single-frame inference (VisionAgent, fp32 and int8) and batched inference (raw batches and
+# BatchedInference shared by several bot threads). The model has the trained policy's shape
+# (ClashCNN + action head) with random weights - speed does not depend on the weights.
+#   python microbench.py --output bench_bot.json
+#   python microbench.py --baseline bench_bot.json   # Prints speedup per benchmark
+
+def write_random_policy(path):
+    net = nn.Sequential(ClashCNN(spaces.Box(0, 255, (1, 224, 128), np.uint8)), nn.Linear(512, 2305))
+    torch.save(net, path)  # InferenceEngine loads pickled modules as well as SB3 .zip files
+    return path
+
+def shared_throughput(policy, frame, bots, seconds):
+    # bots threads calling predict_frame back to back, like GamePipelines sharing one host
+    counts = [0] * bots
+    stop = time.perf_counter() + seconds
+
+    def bot(i):
+        while time.perf_counter() < stop:
+            policy.predict_frame(frame)
+            counts[i] += 1
+    threads = [threading.Thread(target=bot, args=(i,)) for i in range(bots)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {"per_second": round(sum(counts) / (time.perf_counter() - start), 2), "frames": sum(counts)}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--seconds', type=float, default=1.0)  # Minimum time per benchmark
+    parser.add_argument('--threads', type=int, default=None)  # Inference threads (default: half the cores)
+    parser.add_argument('--batches', default='1,4,8,16')
+    args = parser.parse_args()
+
+    frames = synthetic_screenshots()
+    screenshots = itertools.cycle(frames)
+    grays = [preprocess_screenshot(f) for f in frames]
+    gray_cycle = itertools.cycle(grays)
+    encoded_cycle = itertools.cycle([encode_frame(g) for g in grays])
+    results = {}
+    results["preprocess_screenshot"] = measure(lambda: preprocess_screenshot(next(screenshots)), min_seconds=args.seconds)
+    results["encode_frame"] = measure(lambda: encode_frame(next(gray_cycle)), min_seconds=args.seconds)
+    results["compress_screenshot"] = measure(lambda: compress_screenshot(next(screenshots)), min_seconds=args.seconds)
+    results["prepare_frame"] = measure(lambda: prepare_frame(next(screenshots)), min_seconds=args.seconds)
+    results["decompress_image"] = measure(lambda: decompress_image(next(encoded_cycle)), min_seconds=args.seconds)
+
+    workdir = tempfile.mkdtemp(prefix='microbench_')
+    try:
+        model_path = write_random_policy(os.path.join(workdir, 'policy.pth'))
+        for quantize in (False, True):
+            agent = VisionAgent(model_path, 2305, engine_options={"threads": args.threads, "quantize": quantize,
+                                                                  "compile_mode": "trace", "warmup": 5})
+            suffix = '_int8' if quantize else ''
+            results[f"predict_frame{suffix}"] = measure(lambda: agent.predict_frame(next(gray_cycle)), min_seconds=args.seconds)
+            results[f"predict{suffix}"] = measure(lambda: agent.predict(next(encoded_cycle)), min_seconds=args.seconds)
+            for batch in [int(b) for b in args.batches.split(',')]:
+                obs = torch.from_numpy(np.stack(grays[:batch] * (batch // len(grays) + 1))[:batch]).float().unsqueeze(1) / 255.0
+                results[f"act_batch_{batch}{suffix}"] = measure(lambda: agent.model.act(obs), items=batch,
+                                                                min_seconds=args.seconds)
+            if not quantize:
+                for bots in [int(b) for b in args.batches.split(',') if int(b) > 1]:
+                    shared = BatchedInference(agent, max_batch=bots)
+                    results[f"batched_inference_{bots}_bots"] = shared_throughput(shared, grays[0], bots, args.seconds)
+                    # Same agent called from every thread: they share its input tensor, so this is a
+                    # throughput reference only (the real multi-emulator host always batches)
+                    results[f"unbatched_{bots}_bots"] = shared_throughput(agent, grays[0], bots, args.seconds)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report('bot', results, args.output, args.baseline)
+
+if __name__ == '__main__':
+    main()
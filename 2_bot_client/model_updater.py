@@ -0,0 +1,87 @@
+import os
+import hashlib
+import threading
+import logging
+import torch
+from inference_engine import InferenceEngine
+
+class ModelUpdater:
+    # Background model updates so the bot never stalls on download + load: download to a
+    # temp file, verify size/hash/version, build and warm the new InferenceEngine off-thread,
+    # smoke-test it, then swap it into the agent between frames (previous kept for rollback).
+    def __init__(self, client, agent, poll_seconds=300, variant='full'):
+        self.client = client
+        self.agent = agent
+        self.poll_seconds = poll_seconds
+        self.variant = variant  # 'full' | 'fp16' (half-size download, loaded back as float32)
+        self.etag_path = agent.model_path + '.etag'  # ETag of the installed model
+        self.wakeup = threading.Event()
+        self.announced_version = None  # From heartbeat/long-poll responses - saves a /status call
+        self.failed_versions = set()  # Don't retry a model that failed verification/smoke test
+        threading.Thread(target=self._run, name="model-updater", daemon=True).start()
+
+    def notify(self, status):
+        # Called with any server response that carries current_model_version - wakes the updater early
+        version = (status or {}).get('current_model_version')
+        if version is not None and version > self.agent.model_version:
+            self.announced_version = version
+            self.wakeup.set()
+
+    def _run(self):
+        while True:
+            notified = self.wakeup.wait(self.poll_seconds)  # Poll is only the fallback now
+            self.wakeup.clear()
+            try:
+                version = self.announced_version if notified else self.client.get_status().get('current_model_version')
+                if version is not None and version > self.agent.model_version and version not in self.failed_versions:
+                    self.update(version)
+            except Exception as e:
+                logging.error(f"Model update check failed: {e}")
+
+    def update(self, expected_version):
+        tmp_path = self.agent.model_path + '.download'  # Left in place on failure so the next try resumes
+        installed_etag = None
+        if os.path.exists(self.etag_path) and os.path.exists(self.agent.model_path):
+            with open(self.etag_path) as f:
+                installed_etag = f.read().strip()
+        info = self.client.download_model(tmp_path, etag=installed_etag, variant=self.variant)
+        if not info:
+            return False
+        if info['not_modified']:  # Already have these exact bytes - nothing transferred
+            self.agent.set_version(info['version'] if info['version'] is not None else expected_version)
+            return True
+        try:
+            version = info['version'] if info['version'] is not None else expected_version
+            self._verify(tmp_path, info)
+            engine = InferenceEngine(tmp_path, **self.agent.engine_options)  # Built + warmed off-thread
+            self._smoke_test(engine)
+        except Exception as e:
+            logging.error(f"Model v{expected_version} rejected: {e}")
+            self.failed_versions.add(expected_version)
+            os.remove(tmp_path)
+            return False
+        if os.path.exists(self.agent.model_path):
+            os.replace(self.agent.model_path, self.agent.model_path + '.prev')
+        os.replace(tmp_path, self.agent.model_path)  # A restart loads the verified file
+        if info['etag']:
+            with open(self.etag_path, 'w') as f:
+                f.write(info['etag'])
+        self.agent.swap_model(engine, version)
+        return True
+
+    def _verify(self, path, info):
+        size = os.path.getsize(path)
+        if size == 0 or (info['size'] is not None and size != info['size']):
+            raise ValueError(f"Size mismatch ({size} vs {info['size']})")
+        if info['sha256']:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            if digest.hexdigest() != info['sha256']:
+                raise ValueError("SHA-256 mismatch (partial or corrupt download)")
+
+    def _smoke_test(self, engine):
+        logits = engine.logits(torch.zeros(engine.input_shape))
+        if logits.shape[-1] != self.agent.action_size or not torch.isfinite(logits).all():
+            raise ValueError(f"Smoke inference failed (shape {tuple(logits.shape)}, finite={bool(torch.isfinite(logits).all())})")
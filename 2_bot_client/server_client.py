@@ -1,25 +1,31 @@
+import os
 import requests
 import time
 import logging
 from datetime import datetime
+import trajectory_codec
 
 class ServerClient:
-    def __init__(self, server_url):
+    def __init__(self, server_url, bot_id, upload_format='binary', upload_compression='zstd'):
         self.url = server_url.rstrip('/')
         self.session = requests.Session()
-        self.bot_id = None  # Assigned by server
+        self.bot_id = bot_id  # Stable per device (host prefix + emulator serial), unique in the fleet
+        self.registered = False
+        self.upload_format = upload_format  # 'binary' (trajectory_codec) | 'json' (legacy)
+        self.upload_compression = upload_compression  # 'zstd' | 'gzip' | 'none'
 
     def register(self):
-        # On first call, send dummy heartbeat to register
-        resp = self.session.post(f"{self.url}/heartbeat", json={"bot_id": "new", "status": "idle", "timestamp": str(datetime.now())})
+        # On first call, send an idle heartbeat - the server registers unknown bot ids on heartbeat
+        resp = self.session.post(f"{self.url}/heartbeat", json={"bot_id": self.bot_id, "status": "idle", "timestamp": str(datetime.now())})
         if resp.status_code == 200:
-            self.bot_id = resp.json().get('assigned_id', 1)  # Server assigns
+            self.registered = True
             logging.info(f"Registered as bot {self.bot_id}")
             return self.bot_id
         raise ConnectionError("Registration failed")
 
-    def send_heartbeat(self, status, progress):
-        if self.bot_id is None:
+    def send_heartbeat(self, status, progress, metrics=None):
+        # metrics: metrics.Registry.export() - the server re-exports it on /metrics with bot_id
+        if not self.registered:
             self.register()
         payload = {
             "bot_id": self.bot_id,
@@ -27,6 +33,8 @@ class ServerClient:
             "status": status,
             "game_progress": progress
         }
+        if metrics is not None:
+            payload["metrics"] = metrics
         try:
             resp = self.session.post(f"{self.url}/heartbeat", json=payload, timeout=5)
             if resp.status_code == 200:
@@ -36,7 +44,7 @@ class ServerClient:
         return None
 
     def can_i_play(self):
-        if self.bot_id is None:
+        if not self.registered:
             self.register()
         resp = self.session.get(f"{self.url}/can_i_play?bot_id={self.bot_id}", timeout=5)
         if resp.status_code == 200:
@@ -44,8 +52,31 @@ class ServerClient:
             return data['allowed'], data.get('reason', '')
         return False, "Connection error"
 
+    def wait_for_play(self, known_version=None, timeout=25):
+        # Long-poll: returns when a game slot is granted or a model newer than known_version is out
+        if not self.registered:
+            self.register()
+        params = {"bot_id": self.bot_id, "timeout": timeout}
+        if known_version is not None:
+            params["model_version"] = known_version
+        try:
+            resp = self.session.get(f"{self.url}/wait_for_play", params=params, timeout=timeout + 10)
+        except requests.RequestException as e:
+            logging.error(f"Long-poll failed: {e}")
+            time.sleep(5)
+            return {"allowed": False, "reason": "Connection error"}
+        if resp.status_code == 404:  # Old server: fall back to polling
+            allowed, reason = self.can_i_play()
+            if not allowed:
+                time.sleep(5)
+            return {"allowed": allowed, "reason": reason}
+        if resp.status_code == 200:
+            return resp.json()
+        time.sleep(5)
+        return {"allowed": False, "reason": f"Server error {resp.status_code}"}
+
     def get_status(self):
-        if self.bot_id is None:
+        if not self.registered:
             self.register()
         resp = self.session.get(f"{self.url}/status?bot_id={self.bot_id}", timeout=5)
         if resp.status_code == 200:
@@ -53,7 +84,7 @@ class ServerClient:
         return {"should_wait": True}
 
     def send_game_complete(self, trajectory, metadata):
-        if self.bot_id is None:
+        if not self.registered:
             self.register()
         payload = {
             "bot_id": self.bot_id,
@@ -64,7 +95,15 @@ class ServerClient:
             "total_steps": len(trajectory)
         }
         try:
-            resp = self.session.post(f"{self.url}/game_complete", json=payload, timeout=30)
+            if self.upload_format == 'binary':
+                body = trajectory_codec.encode_game(payload, compression=self.upload_compression)
+                resp = self.session.post(f"{self.url}/game_complete", data=body, timeout=30,
+                                         headers={"Content-Type": trajectory_codec.CONTENT_TYPE})
+                if resp.status_code == 415:  # Old server: JSON only
+                    logging.warning("Server does not accept binary trajectories, falling back to JSON")
+                    self.upload_format = 'json'
+            if self.upload_format == 'json':
+                resp = self.session.post(f"{self.url}/game_complete", json=payload, timeout=30)
             if resp.status_code == 200:
                 logging.info("Game data sent")
                 return resp.json()
@@ -72,17 +111,112 @@ class ServerClient:
             logging.error(f"Send failed: {e}")
         return None
 
-    def download_model(self, save_path):
-        if self.bot_id is None:
+    def start_game_session(self):
+        # Streaming upload: returns session_id, None if unreachable, False if server has no streaming
+        if not self.registered:
             self.register()
-        resp = self.session.get(f"{self.url}/download_model", timeout=60)
-        if resp.status_code == 200:
-            with open(save_path, 'wb') as f:
-                f.write(resp.content)
-            logging.info("Model downloaded")
-            return True
-        logging.warning("Model download failed")
-        return False
+        try:
+            resp = self.session.post(f"{self.url}/game_session/start", json={"bot_id": self.bot_id}, timeout=5)
+            if resp.status_code == 200:
+                return resp.json()['session_id']
+            if resp.status_code == 404:
+                return False
+        except requests.RequestException as e:
+            logging.error(f"Session start failed: {e}")
+        return None
+
+    def get_game_session(self, session_id):
+        try:
+            resp = self.session.get(f"{self.url}/game_session/{session_id}", timeout=5)
+            if resp.status_code == 200:
+                return resp.json()
+        except requests.RequestException as e:
+            logging.error(f"Session status failed: {e}")
+        return None
+
+    def send_game_chunk(self, session_id, chunk_index, body):
+        # Returns the server's next expected chunk index, or None on failure
+        try:
+            resp = self.session.post(f"{self.url}/game_session/{session_id}/chunk?index={chunk_index}", data=body,
+                                     headers={"Content-Type": trajectory_codec.CONTENT_TYPE}, timeout=10)
+            if resp.status_code in (200, 409):  # 409: gap, resume from next_chunk
+                return resp.json()['next_chunk']
+        except requests.RequestException as e:
+            logging.error(f"Chunk {chunk_index} upload failed: {e}")
+        return None
+
+    def commit_game_session(self, session_id, metadata, total_reward, total_steps, chunks):
+        payload = {
+            "bot_id": self.bot_id,
+            "timestamp": str(datetime.now()),
+            "game_metadata": metadata,
+            "total_reward": total_reward,
+            "total_steps": total_steps,
+            "chunks": chunks
+        }
+        try:
+            resp = self.session.post(f"{self.url}/game_session/{session_id}/commit", json=payload, timeout=30)
+            if resp.status_code == 200:
+                logging.info("Game session committed")
+                return resp.json()
+            logging.error(f"Commit rejected ({resp.status_code}): {resp.text}")
+        except requests.RequestException as e:
+            logging.error(f"Commit failed: {e}")
+        return None
+
+    def download_model(self, save_path, etag=None, variant='full'):
+        # Streams the model to save_path. etag: the installed model's ETag - the server answers 304
+        # and nothing is transferred if unchanged. A partial save_path left by a failed attempt is
+        # resumed with a Range request (If-Range guards against the model changing meanwhile).
+        # Returns {'version', 'sha256', 'size', 'etag', 'not_modified'}, False on failure.
+        if not self.registered:
+            self.register()
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = f'"{etag}"'
+        partial_etag = None
+        if os.path.exists(save_path) and os.path.exists(save_path + '.etag'):
+            with open(save_path + '.etag') as f:
+                partial_etag = f.read().strip()
+            headers['Range'] = f"bytes={os.path.getsize(save_path)}-"
+            headers['If-Range'] = f'"{partial_etag}"'
+        try:
+            with self.session.get(f"{self.url}/download_model", params={"variant": variant},
+                                  headers=headers, stream=True, timeout=60) as resp:
+                resp_etag = resp.headers.get('ETag', '').strip('"') or None
+                version = resp.headers.get('X-Model-Version')
+                info = {"version": int(version) if version is not None else None,
+                        "sha256": resp.headers.get('X-Model-Sha256'), "etag": resp_etag,
+                        "size": None, "not_modified": resp.status_code == 304}
+                if resp.status_code == 304:
+                    logging.info("Model unchanged (304)")
+                    return info
+                if resp.status_code == 416:  # Stale partial file - start over next time
+                    for path in (save_path, save_path + '.etag'):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    return False
+                if resp.status_code not in (200, 206):
+                    logging.warning(f"Model download failed ({resp.status_code})")
+                    return False
+                resumed = resp.status_code == 206
+                if resumed:
+                    info["size"] = int(resp.headers['Content-Range'].rsplit('/', 1)[1])
+                elif 'Content-Length' in resp.headers:
+                    info["size"] = int(resp.headers['Content-Length'])
+                if resp_etag:
+                    with open(save_path + '.etag', 'w') as f:
+                        f.write(resp_etag)  # Lets an interrupted download resume
+                with open(save_path, 'ab' if resumed else 'wb') as f:
+                    for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                        f.write(chunk)
+        except requests.RequestException as e:
+            logging.warning(f"Model download interrupted: {e}")
+            return False
+        if os.path.exists(save_path + '.etag'):
+            os.remove(save_path + '.etag')
+        logging.info(f"Model downloaded{' (resumed)' if resumed else ''}")
+        return info
 
 # Edge: Retry 3x exponential backoff (1s, 2s, 4s). If server down >60s, use last model, log offline mode.
 # Dynamic ID: Server assigns, bot uses it.
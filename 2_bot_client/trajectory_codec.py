@@ -0,0 +1,250 @@
+import json
+import struct
+import zlib
+import base64
+
+try:
+    import zstandard  # Optional - falls back to gzip when missing
+except ImportError:
+    zstandard = None
+
+# Binary trajectory container (one copy each in 1_central_server/, 2_bot_client/ and 3_kaggle_training/ - keep them identical).
+# Layout (little-endian):
+#   header  : magic 'CRT1' | version u8 | codec u8 | flags u16 | meta_len u32
+#   meta    : JSON (bot_id, timestamp, game_metadata, totals, image_shape, action_details) - never compressed
+#   body    : optionally gzip/zstd compressed:
+#             n u32 | step i32[n] | time f32[n] | action i32[n] | reward f32[n] | done u8[n]
+#             | [image_ref i32[n] if FLAG_IMAGE_REFS] | [action_mask u8[n, mask_bytes] if FLAG_ACTION_MASKS]
+#             | jpeg offsets u32[n+1] | raw JPEG blobs
+# The server reads header + meta only, so it can index a game without touching the images.
+# Deduplicated frames: a step with "image_ref" (the step number of an earlier step in the same
+# game) has an empty image and shows that step's frame; image_ref is -1 for steps with their own.
+# Action masks: "action_mask" is the step's legal actions as packed bits (base64 like the image,
+# one bit per action id); meta action_mask_bytes is the row width. Steps without one are stored
+# as all-legal.
+CONTENT_TYPE = 'application/x-clash-trajectory'
+MAGIC = b'CRT1'
+VERSION = 1
+CODECS = {'none': 0, 'gzip': 1, 'zstd': 2}
+HEADER = struct.Struct('<4sBBHI')
+FLAG_IMAGE_REFS = 1
+FLAG_ACTION_MASKS = 2
+
+# Batch files holding binary games: magic 'CRB1', then per game: format u8 (0 json, 1 binary) | length u32 | bytes
+BATCH_MAGIC = b'CRB1'
+BATCH_RECORD = struct.Struct('<BI')
+BATCH_FORMATS = {'json': 0, 'bin': 1}
+
+def _image_bytes(image):
+    return base64.b64decode(image) if isinstance(image, str) else bytes(image)
+
+def _compress(body, codec):
+    if codec == CODECS['gzip']:
+        return zlib.compress(body, 6)
+    if codec == CODECS['zstd']:
+        return zstandard.ZstdCompressor(level=3).compress(body)
+    return body
+
+def _decompress(body, codec):
+    if codec == CODECS['gzip']:
+        return zlib.decompress(body)
+    if codec == CODECS['zstd']:
+        if zstandard is None:
+            raise ValueError("zstd-compressed trajectory but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(body)
+    return body
+
+def encode_game(payload, compression='zstd'):
+    # payload: the dict ServerClient.send_game_complete would post as JSON
+    trajectory = payload['trajectory']
+    n = len(trajectory)
+    images = [_image_bytes(s['image']) for s in trajectory]
+    meta = {k: v for k, v in payload.items() if k != 'trajectory'}
+    meta['image_shape'] = trajectory[0]['image_shape'] if n else [224, 128]
+    meta['action_details'] = [s.get('action_details') for s in trajectory]
+    refs = [s.get('image_ref') for s in trajectory]
+    flags = FLAG_IMAGE_REFS if any(r is not None for r in refs) else 0
+    masks = [_image_bytes(s['action_mask']) if s.get('action_mask') is not None else None for s in trajectory]
+    widths = {len(m) for m in masks if m is not None}
+    if len(widths) > 1:
+        raise ValueError(f"Action masks of different widths in one game: {sorted(widths)}")
+    if widths:
+        flags |= FLAG_ACTION_MASKS
+        meta['action_mask_bytes'] = width = widths.pop()
+        masks = [b'\xff' * width if m is None else m for m in masks]
+    offsets = [0]
+    for img in images:
+        offsets.append(offsets[-1] + len(img))
+    body = b''.join([
+        struct.pack('<I', n),
+        struct.pack(f'<{n}i', *[s['step'] for s in trajectory]),
+        struct.pack(f'<{n}f', *[s['time'] for s in trajectory]),
+        struct.pack(f'<{n}i', *[s['action'] for s in trajectory]),
+        struct.pack(f'<{n}f', *[s['reward'] for s in trajectory]),
+        struct.pack(f'<{n}B', *[bool(s.get('done', False)) for s in trajectory]),
+        struct.pack(f'<{n}i', *[-1 if r is None else r for r in refs]) if flags & FLAG_IMAGE_REFS else b'',
+        b''.join(masks) if flags & FLAG_ACTION_MASKS else b'',
+        struct.pack(f'<{n + 1}I', *offsets),
+    ] + images)
+    meta_bytes = json.dumps(meta).encode('utf-8')
+    if compression == 'zstd' and zstandard is None:
+        compression = 'gzip'
+    codec = CODECS[compression]
+    return HEADER.pack(MAGIC, VERSION, codec, flags, len(meta_bytes)) + meta_bytes + _compress(body, codec)
+
+def read_meta(blob):
+    # Header + metadata only (cheap: no decompression, no image decode)
+    if len(blob) < HEADER.size:
+        raise ValueError("Truncated trajectory container")
+    magic, version, codec, _, meta_len = HEADER.unpack_from(blob, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a v{VERSION} trajectory container")
+    return json.loads(bytes(blob[HEADER.size:HEADER.size + meta_len]))
+
+def _read_columns(blob):
+    # Header, meta and the per-step columns of one container; the images stay in body from image_pos
+    if len(blob) < HEADER.size:
+        raise ValueError("Truncated trajectory container")
+    magic, version, codec, flags, meta_len = HEADER.unpack_from(blob, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a v{VERSION} trajectory container")
+    meta = json.loads(bytes(blob[HEADER.size:HEADER.size + meta_len]))
+    body = _decompress(bytes(blob[HEADER.size + meta_len:]), codec)
+    (n,) = struct.unpack_from('<I', body, 0)
+    pos = 4
+    columns = {'n': n, 'refs': None, 'masks': None, 'width': meta.pop('action_mask_bytes', None)}
+    columns['steps'] = struct.unpack_from(f'<{n}i', body, pos); pos += 4 * n
+    columns['times'] = struct.unpack_from(f'<{n}f', body, pos); pos += 4 * n
+    columns['actions'] = struct.unpack_from(f'<{n}i', body, pos); pos += 4 * n
+    columns['rewards'] = struct.unpack_from(f'<{n}f', body, pos); pos += 4 * n
+    columns['dones'] = struct.unpack_from(f'<{n}B', body, pos); pos += n
+    if flags & FLAG_IMAGE_REFS:
+        columns['refs'] = struct.unpack_from(f'<{n}i', body, pos); pos += 4 * n
+    if flags & FLAG_ACTION_MASKS:
+        columns['masks'] = body[pos:pos + columns['width'] * n]; pos += columns['width'] * n
+    columns['offsets'] = struct.unpack_from(f'<{n + 1}I', body, pos); pos += 4 * (n + 1)
+    return meta, columns, body, pos
+
+def decode_game(blob, images_as='base64'):
+    # Inverse of encode_game. images_as='base64' reproduces the JSON upload layout exactly,
+    # 'bytes' skips the base64 round-trip for consumers that decode the JPEG directly.
+    meta, columns, body, pos = _read_columns(blob)
+    refs, masks, width, offsets = columns['refs'], columns['masks'], columns['width'], columns['offsets']
+    shape = meta.pop('image_shape')
+    details = meta.pop('action_details')
+    trajectory = []
+    for i in range(columns['n']):
+        img = body[pos + offsets[i]:pos + offsets[i + 1]]
+        step = {
+            "step": columns['steps'][i],
+            "time": columns['times'][i],
+            "image": base64.b64encode(img).decode('utf-8') if images_as == 'base64' else img,
+            "image_shape": shape,
+            "action": columns['actions'][i],
+            "action_details": details[i],
+            "reward": columns['rewards'][i],
+            "done": bool(columns['dones'][i])
+        }
+        if refs is not None and refs[i] >= 0:
+            step["image_ref"] = refs[i]
+        if masks is not None:
+            mask = masks[i * width:(i + 1) * width]
+            step["action_mask"] = base64.b64encode(mask).decode('utf-8') if images_as == 'base64' else mask
+        trajectory.append(step)
+    meta['trajectory'] = trajectory
+    return meta
+
+def concat_games(read_chunks, payload):
+    # One uncompressed container from a game uploaded in chunks - the same bytes
+    # encode_game(merged, 'none') would give, without holding the game's images in memory.
+    # read_chunks(): fresh iterator over the chunk containers; called twice (columns, then images).
+    # payload: game-level fields (bot_id, timestamp, game_metadata, totals - these default from the steps).
+    # Returns (meta, pieces): pieces yields the container bytes, reading one chunk at a time.
+    # ValueError for mismatched action mask widths or image_refs that don't resolve.
+    steps, times, actions, rewards, dones, refs, masks, sizes, details = [], [], [], [], [], [], [], [], []
+    shape, width = [224, 128], None
+    for i, blob in enumerate(read_chunks()):
+        meta, columns, _, _ = _read_columns(blob)
+        n = columns['n']
+        if i == 0:
+            shape = meta['image_shape']
+        steps.extend(columns['steps'])
+        times.extend(columns['times'])
+        actions.extend(columns['actions'])
+        rewards.extend(columns['rewards'])
+        dones.extend(columns['dones'])
+        refs.extend(columns['refs'] or [-1] * n)
+        details.extend(meta['action_details'])
+        offsets = columns['offsets']
+        sizes.extend(offsets[j + 1] - offsets[j] for j in range(n))
+        if columns['masks'] is not None:
+            if width is not None and columns['width'] != width:
+                raise ValueError(f"Action masks of different widths in one game: {width}, {columns['width']}")
+            width = columns['width']
+        masks.append((n, columns['masks']))
+    image_sources([{'step': s} if r < 0 else {'step': s, 'image_ref': r} for s, r in zip(steps, refs)])
+    n = len(steps)
+    meta = dict(payload)
+    meta.setdefault('total_steps', n)
+    meta.setdefault('total_reward', sum(rewards))
+    flags = FLAG_IMAGE_REFS if any(r >= 0 for r in refs) else 0
+    header_meta = dict(meta, image_shape=shape, action_details=details)
+    if width is not None:
+        flags |= FLAG_ACTION_MASKS
+        header_meta['action_mask_bytes'] = width
+    offsets = [0]
+    for size in sizes:
+        offsets.append(offsets[-1] + size)
+    meta_bytes = json.dumps(header_meta).encode('utf-8')
+
+    def pieces():
+        yield HEADER.pack(MAGIC, VERSION, CODECS['none'], flags, len(meta_bytes)) + meta_bytes
+        yield b''.join([
+            struct.pack('<I', n),
+            struct.pack(f'<{n}i', *steps),
+            struct.pack(f'<{n}f', *times),
+            struct.pack(f'<{n}i', *actions),
+            struct.pack(f'<{n}f', *rewards),
+            struct.pack(f'<{n}B', *dones),
+            struct.pack(f'<{n}i', *refs) if flags & FLAG_IMAGE_REFS else b'',
+            b''.join(m if m is not None else b'\xff' * (width * count) for count, m in masks)
+            if flags & FLAG_ACTION_MASKS else b'',
+            struct.pack(f'<{n + 1}I', *offsets),
+        ])
+        for blob in read_chunks():
+            _, columns, body, pos = _read_columns(blob)
+            yield body[pos:pos + columns['offsets'][-1]]
+    return meta, pieces()
+
+def image_sources(trajectory):
+    # Index of the step whose frame each step shows: its own, or the earlier step its image_ref
+    # names (by step number). ValueError for a ref to a missing step or to another ref
+    own, sources = {}, []
+    for i, s in enumerate(trajectory):
+        ref = s.get('image_ref')
+        if ref is None:
+            own[s['step']] = i
+            sources.append(i)
+        elif ref in own:
+            sources.append(own[ref])
+        else:
+            raise ValueError(f"Step {s['step']} references step {ref}, which has no frame of its own")
+    return sources
+
+def iter_batch(path, images_as='base64'):
+    # Yields game dicts from a batch file: legacy JSON array or a CRB1 framed container
+    with open(path, 'rb') as f:
+        if f.read(len(BATCH_MAGIC)) != BATCH_MAGIC:
+            f.seek(0)
+            yield from json.load(f)
+            return
+        while True:
+            header = f.read(BATCH_RECORD.size)
+            if len(header) < BATCH_RECORD.size:
+                return
+            fmt, length = BATCH_RECORD.unpack(header)
+            data = f.read(length)
+            if fmt == BATCH_FORMATS['bin']:
+                yield decode_game(data, images_as=images_as)
+            else:
+                yield json.loads(data)
@@ -0,0 +1,166 @@
+import os
+import glob
+import uuid
+import time
+import threading
+import logging
+import trajectory_codec
+
+class StreamingUploader:
+    # Streams a game to the server while it is being played. Every chunk_steps steps are
+    # encoded with trajectory_codec and spooled to disk; a background thread uploads spooled
+    # chunks in order and deletes each once the server acknowledges it. After a failure it
+    # asks the server for the last acknowledged chunk and resumes from there. Memory use is
+    # one chunk of steps no matter how long the game runs.
+    def __init__(self, client, chunk_steps=10, spool_dir='upload_spool', compression='zstd', commit_timeout=120):
+        self.client = client
+        self.chunk_steps = chunk_steps
+        self.spool_dir = spool_dir
+        self.compression = compression
+        self.commit_timeout = commit_timeout
+        self.cond = threading.Condition()
+        os.makedirs(spool_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(spool_dir, '*.bin')):
+            os.remove(stale)  # Leftovers from a killed process belong to a session we can't commit
+        self._reset()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _reset(self):
+        self.game_key = uuid.uuid4().hex[:12]
+        self.session_id = None
+        self.legacy = False  # Server without /game_session: send the whole game at the end
+        self.buffer = []
+        self.held = None  # Newest step, held back so the final reward can still be added
+        self.spooled = 0  # Chunks written to the spool
+        self.acked = 0  # Chunks the server has confirmed
+        self.failures = 0
+        self.total_reward = 0.0
+        self.total_steps = 0
+
+    def _chunk_path(self, index):
+        return os.path.join(self.spool_dir, f"{self.game_key}_{index:05d}.bin")
+
+    def start_game(self):
+        with self.cond:
+            self._reset()
+        sid = self.client.start_game_session()  # Retried by the upload thread if it fails here
+        with self.cond:
+            if sid is False:
+                self.legacy = True
+            elif sid:
+                self.session_id = sid
+
+    def add_step(self, step):
+        if self.held is not None:
+            self.buffer.append(self.held)
+        self.held = step
+        if len(self.buffer) >= self.chunk_steps:
+            self._spool(self.buffer)
+            self.buffer = []
+
+    def _spool(self, steps):
+        self.total_reward += sum(s['reward'] for s in steps)
+        self.total_steps += len(steps)
+        body = trajectory_codec.encode_game({"bot_id": self.client.bot_id, "chunk_index": self.spooled,
+                                             "trajectory": steps}, compression=self.compression)
+        with open(self._chunk_path(self.spooled), 'wb') as f:
+            f.write(body)
+        with self.cond:
+            self.spooled += 1
+            self.cond.notify_all()
+
+    def finish(self, metadata, final_reward):
+        # Flush the tail, wait for every chunk to be acknowledged, then seal the game on the server
+        if self.held is not None:
+            self.held['reward'] += final_reward
+            self.held['done'] = True
+            self.buffer.append(self.held)
+            self.held = None
+        if self.buffer:
+            self._spool(self.buffer)
+            self.buffer = []
+        deadline = time.time() + self.commit_timeout
+        with self.cond:
+            self.cond.notify_all()
+            while (not self.legacy and self.spooled and (self.session_id is None or self.acked < self.spooled)
+                   and time.time() < deadline):
+                self.cond.wait(timeout=1.0)
+            legacy, session_id, drained = self.legacy, self.session_id, self.acked >= self.spooled
+        result = None
+        if legacy:
+            result = self._send_legacy(metadata)
+        elif session_id and drained:
+            result = self.client.commit_game_session(session_id, metadata, self.total_reward, self.total_steps, self.spooled)
+        else:
+            logging.error(f"Upload incomplete after {self.commit_timeout}s ({self.acked}/{self.spooled} chunks) - game lost")
+        for path in glob.glob(os.path.join(self.spool_dir, f"{self.game_key}_*.bin")):
+            os.remove(path)
+        return result
+
+    def _send_legacy(self, metadata):
+        # Old server: rebuild the full trajectory from the spool and post it in one request
+        trajectory = []
+        for index in range(self.spooled):
+            with open(self._chunk_path(index), 'rb') as f:
+                trajectory.extend(trajectory_codec.decode_game(f.read())['trajectory'])
+        return self.client.send_game_complete(trajectory, metadata)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                idle = self.legacy or self.acked >= self.spooled
+                self.cond.wait(timeout=None if idle else min(30, 2 ** self.failures))
+            try:
+                self._pump()
+            except Exception as e:  # Never let the upload thread die mid-game
+                logging.error(f"Upload thread error: {e}")
+
+    def _pump(self):
+        with self.cond:
+            if self.legacy or self.acked >= self.spooled:
+                return
+            session_id = self.session_id
+        if session_id is None:
+            sid = self.client.start_game_session()
+            with self.cond:
+                if sid is False:
+                    self.legacy = True
+                elif sid:
+                    self.session_id = session_id = sid
+                else:
+                    self.failures += 1
+                self.cond.notify_all()
+            if not sid:
+                return
+        if self.failures:
+            # Resume: the server may have stored chunks whose acks we never saw
+            status = self.client.get_game_session(session_id)
+            if status is not None:
+                self._acknowledge(status['next_chunk'])
+        while True:
+            with self.cond:
+                index, spooled = self.acked, self.spooled
+            if index >= spooled:
+                break
+            with open(self._chunk_path(index), 'rb') as f:
+                body = f.read()
+            next_chunk = self.client.send_game_chunk(session_id, index, body)
+            if next_chunk is None or next_chunk <= index:
+                with self.cond:
+                    self.failures += 1
+                if next_chunk is not None:
+                    logging.error(f"Server lost acknowledged chunks ({next_chunk} < {index})")
+                return
+            self._acknowledge(next_chunk)
+
+    def _acknowledge(self, next_chunk):
+        with self.cond:
+            if next_chunk > self.acked:
+                self.failures = 0  # Progress - backoff starts over
+            for index in range(self.acked, min(next_chunk, self.spooled)):
+                try:
+                    os.remove(self._chunk_path(index))
+                except FileNotFoundError:
+                    pass
+            self.acked = max(self.acked, min(next_chunk, self.spooled))
+            self.cond.notify_all()
@@ -1,33 +1,84 @@
+import os
 import torch
+import numpy as np
 import random
 import logging
 from image_utils import decompress_image
+from inference_engine import InferenceEngine
 
 class VisionAgent:
-    def __init__(self, model_path, action_size=2305):
+    def __init__(self, model_path, action_size=2305, engine_options=None):
         self.model_path = model_path
         self.action_size = action_size
+        self.engine_options = engine_options or {}  # InferenceEngine kwargs: threads, quantize, compile_mode, warmup
         self.model = None
+        self.previous_model = None  # Kept after a hot swap for rollback
+        self.model_version = self._read_version()
+        self.input_tensor = torch.empty((1, 1, 224, 128), dtype=torch.float32)  # Reused every frame
         self.load_model()
 
+    def _read_version(self):
+        try:
+            with open(self.model_path + '.version') as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return 0
+
     def load_model(self):
         try:
-            self.model = torch.load(self.model_path)  # PPO policy
-            self.model.eval()
+            self.model = InferenceEngine(self.model_path, **self.engine_options)  # PPO policy, optimized + warmed up
             logging.info("Model loaded")
         except FileNotFoundError:
             logging.warning("No model - using random actions")
             self.model = None
 
-    def predict(self, compressed_image):
+    def swap_model(self, engine, version):
+        # Single reference assignment: a frame in flight finishes on the old model, the next uses the new
+        self.previous_model, self.model = self.model, engine
+        self.set_version(version)
+        logging.info(f"Swapped to model v{version}")
+
+    def set_version(self, version):
+        self.model_version = version
+        with open(self.model_path + '.version', 'w') as f:
+            f.write(str(version))
+
+    def rollback(self):
+        if self.previous_model is None:
+            return False
+        self.model, self.previous_model = self.previous_model, None
+        logging.warning("Rolled back to previous model")
+        return True
+
+    def random_action(self, mask=None):
+        # Uniform over the legal actions (mask: bool [action_size]) or over all of them
+        if mask is None:
+            return random.randint(0, self.action_size - 1)
+        return int(random.choice(np.flatnonzero(mask)))
+
+    def predict(self, compressed_image, mask=None):
+        # Trajectory-format input (base64 JPEG); the game loop uses predict_frame directly
         if self.model is None:
+            return self.random_action(mask)
+        return self.predict_frame(decompress_image(compressed_image), mask)
+
+    def predict_frame(self, frame, mask=None):
+        # frame: uint8 [224, 128] from image_utils.preprocess_screenshot - no decode, no allocation
+        # mask: optional bool [action_size] from ActionMasker - only legal actions are sampled
+        model = self.model  # One read per frame: a concurrent swap can't change it mid-frame
+        if model is None:
             # Random for initial
-            return random.randint(0, self.action_size - 1)
-        img = decompress_image(compressed_image)
-        img_tensor = torch.from_numpy(img).float().unsqueeze(0).unsqueeze(0) / 255.0  # [1,1,H,W]
-        with torch.no_grad():
-            action, _ = self.model.predict(img_tensor, deterministic=False)  # PPO predict
-        return int(action)
+            return self.random_action(mask)
+        img = self.input_tensor[0, 0]
+        img.copy_(torch.from_numpy(frame))  # uint8 -> float32 in place
+        img.mul_(1.0 / 255.0)
+        try:
+            return model.act(self.input_tensor, deterministic=False, mask=mask)  # PPO policy sample
+        except Exception as e:
+            logging.error(f"Inference failed: {e}")
+            if model is self.model and self.rollback():
+                return self.model.act(self.input_tensor, deterministic=False, mask=mask)
+            raise
 
     def encode_action(self, slot, x, y):
         if slot is None:
@@ -44,4 +95,4 @@ class VisionAgent:
         y = pos_id // 24
         return slot, x, y
 
-# Edge: Invalid action (e.g., low elixir? Log, but play anyway - AI learns). Reload model after download.
+# Edge: Illegal actions (low elixir, enemy side) are masked before sampling - see ActionMasker. Reload model after download.
@@ -0,0 +1,78 @@
+import os
+import sys
+import json
+import time
+import platform
+import subprocess
+import numpy as np
+
+# Micro-benchmark helpers (one copy each in 2_bot_client/ and 3_kaggle_training/ - keep them identical). Results are
+# plain JSON so runs from different commits can be diffed with compare(); every result has
+# per_second (higher is better).
+
+def synthetic_screenshots(n=16, seed=0):
+    # 720x1280 BGR emulator-sized frames: smooth background + blocks, so JPEG sizes are realistic
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:1280, 0:720]
+    background = np.stack([(xs * 255 // 720), (ys * 255 // 1280), np.full_like(xs, 96)], axis=-1).astype(np.uint8)
+    frames = []
+    for _ in range(n):
+        frame = background.copy()
+        for x, y, v in zip(rng.integers(0, 680, 12), rng.integers(0, 1240, 12), rng.integers(0, 256, 12)):
+            frame[y:y + 40, x:x + 40] = v
+        frames.append(frame)
+    return frames
+
+def measure(fn, items=1, min_seconds=1.0, min_calls=5, warmup=2):
+    # Calls fn() until min_seconds and min_calls are both reached; items = units per call
+    for _ in range(warmup):
+        fn()
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < min_calls or time.perf_counter() - start < min_seconds:
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+    timings.sort()
+    return {
+        "per_second": round(items * len(timings) / sum(timings), 2),
+        "p50_ms": round(timings[len(timings) // 2] * 1000, 3),
+        "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000, 3),
+        "calls": len(timings)
+    }
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    env = {"commit": commit, "python": platform.python_version(), "machine": platform.machine(),
+           "cpu_count": os.cpu_count(), "numpy": np.__version__}
+    for module in ('torch', 'cv2'):
+        if module in sys.modules:
+            env[module] = sys.modules[module].__version__
+    return env
+
+def compare(results, baseline):
+    # {name: new per_second / old per_second} for benchmarks present in both runs
+    ratios = {}
+    for name, result in results.items():
+        old = baseline.get('results', {}).get(name)
+        if old and old.get('per_second') and result.get('per_second'):
+            ratios[name] = round(result['per_second'] / old['per_second'], 3)
+    return ratios
+
+def report(suite, results, output=None, baseline=None):
+    doc = {"suite": suite, "time": time.strftime('%Y-%m-%dT%H:%M:%S'), "environment": environment(), "results": results}
+    text = json.dumps(doc, indent=2)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text)
+    if baseline:
+        with open(baseline) as f:
+            old = json.load(f)
+        for name, ratio in compare(results, old).items():
+            print(f"{name}: {ratio:.2f}x vs {old['environment'].get('commit')}", file=sys.stderr)
+    return doc
@@ -1,25 +1,166 @@
-import json
+import os
+import time
+import base64
+import hashlib
+import logging
 import numpy as np
 import torch
-from image_utils import decompress_image  # Shared, copy to folder
-
-def load_batch(batch_file):
-    with open(batch_file, 'r') as f:
-        batch = json.load(f)  # List of 16 games
-    trajectories = []
-    for game in batch:
-        traj = game['trajectory']
-        obs = []
-        actions = []
-        rewards = []
-        dones = []
-        for step in traj:
-            obs.append(decompress_image({"data": step['image'], "shape": step['image_shape']}))
+from concurrent.futures import ThreadPoolExecutor
+from image_utils import decode_jpeg  # Shared, copy to folder
+from trajectory_codec import iter_batch, image_sources  # Shared, copy to folder
+from metrics import REGISTRY, FRAME_BUCKETS  # Shared, copy to folder
+
+DECODE_SECONDS = REGISTRY.histogram('clash_train_decode_frame_seconds', 'JPEG decode per frame', buckets=FRAME_BUCKETS)
+LOAD_SECONDS = REGISTRY.histogram('clash_train_batch_load_seconds', 'Batch parse + decode into the frame cache')
+CACHE_MAX_BYTES = 8 * 1024 ** 3  # ~300k frames; least recently used batches are evicted past this
+
+class FrameBatch:
+    # Decoded batch backed by files: frames is a uint8 memmap [N, 224, 128] for all games
+    # back to back, game_offsets [G + 1] marks game boundaries in the flat step arrays.
+    # action_masks: packed legal-action bits per step (uint8 [N, mask_bytes], np.packbits order;
+    # all-ones for steps logged without a mask), or None when no game in the batch had masks.
+    # Memmaps are opened copy-on-write, so slices can go to torch without touching the cache.
+    def __init__(self, frames_path, index_path):
+        index = np.load(index_path)
+        self.actions = index['actions']
+        self.rewards = index['rewards']
+        self.dones = index['dones']
+        self.game_offsets = index['game_offsets']
+        self.action_masks = index['action_masks'] if 'action_masks' in index.files else None
+        shape = tuple(index['frame_shape'])
+        n = len(self.actions)
+        self.frames = np.memmap(frames_path, dtype=np.uint8, mode='c', shape=(n,) + shape) if n else np.zeros((0,) + shape, np.uint8)
+
+    def __len__(self):
+        return len(self.actions)
+
+    def games(self):
+        # Per-game (obs, actions, rewards, dones) views - frames are paged in lazily
+        for start, end in zip(self.game_offsets[:-1], self.game_offsets[1:]):
+            yield (self.frames[start:end], self.actions[start:end], self.rewards[start:end], self.dones[start:end])
+
+def _cache_paths(batch_file, cache_dir):
+    st = os.stat(batch_file)
+    key = hashlib.sha1(f"{os.path.abspath(batch_file)}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:16]
+    base = os.path.join(cache_dir, f"{os.path.splitext(os.path.basename(batch_file))[0]}_{key}")
+    return base + '.frames.u8', base + '.index.npz'
+
+def drop_cached_frames(batch_file, cache_dir='frame_cache'):
+    # Remove a batch's cache entry - call while the batch file still exists (its stat is the key)
+    for path in _cache_paths(batch_file, cache_dir):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:  # Still mapped (Windows) - LRU eviction gets it later
+            logging.warning(f"Frame cache entry not removed: {e}")
+
+def _evict(cache_dir, max_bytes, keep):
+    # Least recently used entries (index mtime, refreshed on every hit) go first; keep is never evicted
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.index.npz'):
+            index_path = os.path.join(cache_dir, name)
+            frames_path = index_path[:-len('.index.npz')] + '.frames.u8'
+            try:
+                size = os.path.getsize(index_path) + (os.path.getsize(frames_path) if os.path.exists(frames_path) else 0)
+                entries.append((os.path.getmtime(index_path), size, frames_path, index_path))
+            except FileNotFoundError:
+                continue  # Evicted by another worker meanwhile
+    total = sum(e[1] for e in entries)
+    for _, size, frames_path, index_path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if index_path == keep:
+            continue
+        try:
+            for path in (index_path, frames_path):  # Index first: a frames file without one is never read
+                if os.path.exists(path):
+                    os.remove(path)
+        except OSError as e:  # In use by another worker (Windows) or gone meanwhile
+            logging.warning(f"Frame cache entry not evicted: {e}")
+            continue
+        total -= size
+        logging.info(f"Frame cache over {max_bytes / 1024 ** 3:.1f}GB: evicted {os.path.basename(frames_path)}")
+
+def load_batch_frames(batch_file, cache_dir='frame_cache', workers=None, max_cache_bytes=CACHE_MAX_BYTES):
+    # Decode once into a memory-mapped frame store; later runs on the same batch skip decoding.
+    # The cache directory is capped at max_cache_bytes (LRU); train_ppo drops a batch's entry
+    # once it trained on it successfully
+    os.makedirs(cache_dir, exist_ok=True)
+    frames_path, index_path = _cache_paths(batch_file, cache_dir)
+    if os.path.exists(frames_path) and os.path.exists(index_path):
+        os.utime(index_path)  # Recently used
+        return FrameBatch(frames_path, index_path)
+
+    # Pass 1: keep only the compressed JPEG bytes (~4KB/frame) and the scalar columns.
+    # Deduplicated steps (image_ref) get no JPEG, just the flat index of the frame they repeat
+    t_load = time.perf_counter()
+    jpegs, copies, actions, rewards, dones, masks, game_offsets = [], [], [], [], [], [], [0]
+    frame_shape = (224, 128)
+    for game in iter_batch(batch_file, images_as='bytes'):  # JSON array or CRB1 container with binary games
+        trajectory = game['trajectory']
+        try:
+            sources = image_sources(trajectory)
+        except ValueError as e:
+            logging.warning(f"Skipping game from bot {game.get('bot_id')}: {e}")  # Don't fail the whole batch
+            continue
+        base = len(jpegs)
+        for i, (step, source) in enumerate(zip(trajectory, sources)):
+            if source == i:
+                image = step['image']
+                jpegs.append(base64.b64decode(image) if isinstance(image, str) else image)
+            else:
+                jpegs.append(None)
+                copies.append((base + i, base + source))
             actions.append(step['action'])
             rewards.append(step['reward'])
             dones.append(step.get('done', False))
-        trajectories.append((np.array(obs), np.array(actions), np.array(rewards), np.array(dones)))
-    return trajectories  # For PPO replay
+            mask = step.get('action_mask')
+            masks.append(base64.b64decode(mask) if isinstance(mask, str) else mask)
+            frame_shape = tuple(step['image_shape'])
+        game_offsets.append(len(actions))
+
+    # Pass 2: parallel decode straight into the preallocated memmap
+    n = len(jpegs)
+    tmp_frames = frames_path + '.tmp'
+    if n:
+        frames = np.memmap(tmp_frames, dtype=np.uint8, mode='w+', shape=(n,) + frame_shape)
+
+        def decode_into(i):
+            t0 = time.perf_counter()
+            frames[i] = decode_jpeg(jpegs[i])
+            DECODE_SECONDS.observe(time.perf_counter() - t0)
+
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            list(pool.map(decode_into, [i for i in range(n) if jpegs[i] is not None]))
+        for i, source in copies:  # The trainer sees every step's frame, decoded once per unique image
+            frames[i] = frames[source]
+        frames.flush()
+        del frames
+    else:
+        open(tmp_frames, 'wb').close()
+    columns = {}
+    width = next((len(m) for m in masks if m is not None), None)
+    if width is not None:
+        packed = np.full((n, width), 0xFF, dtype=np.uint8)  # Unmasked steps: every action legal
+        for i, mask in enumerate(masks):
+            if mask is not None and len(mask) == width:
+                packed[i] = np.frombuffer(mask, dtype=np.uint8)
+        columns['action_masks'] = packed
+    tmp_index = index_path + '.tmp.npz'
+    np.savez(tmp_index, actions=np.array(actions, dtype=np.int64), rewards=np.array(rewards, dtype=np.float32),
+             dones=np.array(dones, dtype=bool), game_offsets=np.array(game_offsets, dtype=np.int64),
+             frame_shape=np.array(frame_shape, dtype=np.int64), **columns)
+    os.replace(tmp_frames, frames_path)
+    os.replace(tmp_index, index_path)  # Index last: its presence marks a complete cache entry
+    _evict(cache_dir, max_cache_bytes, keep=index_path)
+    LOAD_SECONDS.observe(time.perf_counter() - t_load)
+    return FrameBatch(frames_path, index_path)
+
+def load_batch(batch_file, cache_dir='frame_cache', workers=None):
+    # Per-game (obs, actions, rewards, dones) as before, backed by the memmapped cache
+    return list(load_batch_frames(batch_file, cache_dir, workers).games())  # For PPO replay
 
 def preprocess_images(images):
     # [N, H, W] -> [N, 1, H, W] normalized
@@ -0,0 +1,143 @@
+import os
+import sys
+import json
+import time
+import shutil
+import itertools
+import argparse
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import numpy as np
+import torch
+from gymnasium import spaces
+from image_utils import preprocess_screenshot, encode_frame, decode_jpeg, decompress_image
+from data_loader import load_batch, preprocess_images
+from model import ClashCNN
+import trajectory_codec
+from benchmark_utils import synthetic_screenshots, measure, report
+
+# Training-side hot paths on synthetic data: JPEG decode, preprocess_images, ClashCNN.forward and
+# load_batch time + memory vs batch size (cold = decode into the frame cache, warm = cache hit).
+# Loader runs happen in a child process each, so peak memory is not polluted by earlier runs.
+#   python microbench.py --output bench_train.json
+#   python microbench.py --baseline bench_train.json   # Prints speedup per benchmark
+
+def write_batch(path, games, steps, frames):
+    # CRB1 batch of zstd binary games, as the server hands them to training. Every step gets its
+    # own frame (a base frame plus a moving block), else zstd would dedupe the repeated JPEGs
+    grays = [preprocess_screenshot(f) for f in frames]
+    rng = np.random.default_rng(1)
+
+    def frame(g, i):
+        gray = grays[(g + i) % len(grays)].copy()
+        x, y = rng.integers(0, 112), rng.integers(0, 208)
+        gray[y:y + 16, x:x + 16] = rng.integers(0, 256)
+        return encode_frame(gray)
+    with open(path, 'wb') as out:
+        out.write(trajectory_codec.BATCH_MAGIC)
+        for g in range(games):
+            trajectory = []
+            for i in range(steps):
+                encoded = frame(g, i)
+                trajectory.append({"step": i, "time": i * 3.0, "image": encoded['data'], "image_shape": encoded['shape'],
+                                   "action": (g * 31 + i * 7) % 2305, "action_details": None, "reward": -0.1,
+                                   "done": i == steps - 1})
+            blob = trajectory_codec.encode_game({"bot_id": "bench", "timestamp": "", "game_metadata": {},
+                                                 "trajectory": trajectory, "total_reward": -0.1 * steps,
+                                                 "total_steps": steps})
+            out.write(trajectory_codec.BATCH_RECORD.pack(trajectory_codec.BATCH_FORMATS['bin'], len(blob)) + blob)
+    return path
+
+def _rss_mb():
+    # Current resident set size (Linux); None elsewhere
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def load_child(batch_file, cache_dir):
+    # Runs in a fresh process: one load_batch call, time + Python/numpy heap peak (tracemalloc)
+    # + peak RSS growth (sampled every 5ms - also sees cv2 buffers and page-cache-backed memmaps)
+    rss_before = _rss_mb()
+    rss_peak = [rss_before]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.005):
+            rss_peak[0] = max(rss_peak[0], _rss_mb())
+    if rss_before is not None:
+        threading.Thread(target=sample, daemon=True).start()
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    games = load_batch(batch_file, cache_dir)
+    elapsed = time.perf_counter() - t0
+    heap_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    done.set()
+    print(json.dumps({"seconds": elapsed, "steps": sum(len(g[1]) for g in games), "heap_peak_mb": heap_peak / 1e6,
+                      "rss_growth_mb": rss_peak[0] - rss_before if rss_before is not None else None}))
+
+def bench_loader(results, workdir, sizes, steps, frames):
+    for games in sizes:
+        batch_file = write_batch(os.path.join(workdir, f"batch_{games}.bin"), games, steps, frames)
+        cache_dir = os.path.join(workdir, f"cache_{games}")
+        for phase in ('cold', 'warm'):  # Same cache dir: the second run hits the cache
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), '--load-child', batch_file, cache_dir],
+                                 capture_output=True, text=True, check=True).stdout
+            run = json.loads(out.strip().splitlines()[-1])
+            results[f"load_batch_{phase}_{games}_games"] = {
+                "per_second": round(run['steps'] / run['seconds'], 2),  # Steps/s
+                "seconds": round(run['seconds'], 4),
+                "batch_mb": round(os.path.getsize(batch_file) / 1e6, 2),
+                "heap_peak_mb": round(run['heap_peak_mb'], 2),
+                "rss_growth_mb": round(run['rss_growth_mb'], 2) if run['rss_growth_mb'] is not None else None
+            }
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--seconds', type=float, default=1.0)  # Minimum time per benchmark
+    parser.add_argument('--sizes', default='4,16,64')  # Games per batch for the loader
+    parser.add_argument('--steps', type=int, default=100)  # Steps per synthetic game
+    parser.add_argument('--threads', type=int, default=None)
+    parser.add_argument('--load-child', nargs=2, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.load_child:
+        load_child(*args.load_child)
+        return
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    frames = synthetic_screenshots()
+    encoded = [encode_frame(preprocess_screenshot(f)) for f in frames]
+    jpegs = [trajectory_codec._image_bytes(e['data']) for e in encoded]
+    results = {}
+    jpeg_cycle, encoded_cycle = itertools.cycle(jpegs), itertools.cycle(encoded)
+    results["decode_jpeg"] = measure(lambda: decode_jpeg(next(jpeg_cycle)), min_seconds=args.seconds)
+    results["decompress_image"] = measure(lambda: decompress_image(next(encoded_cycle)), min_seconds=args.seconds)
+    stack = np.stack([decode_jpeg(j) for j in jpegs] * 16)  # [256, 224, 128]
+    results["preprocess_images_256"] = measure(lambda: preprocess_images(stack), items=len(stack), min_seconds=args.seconds)
+
+    cnn = ClashCNN(spaces.Box(0, 255, (1, 224, 128), np.uint8)).eval()
+    for batch in (1, 64, 256):
+        obs = preprocess_images(stack[:batch])
+
+        def forward():
+            with torch.inference_mode():
+                cnn(obs)
+        results[f"clashcnn_forward_{batch}"] = measure(forward, items=batch, min_seconds=args.seconds)
+
+    workdir = tempfile.mkdtemp(prefix='microbench_')
+    try:
+        bench_loader(results, workdir, [int(s) for s in args.sizes.split(',')], args.steps, frames)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    report('training', results, args.output, args.baseline)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import json
+import os
+import random
+import threading
+import logging
+import trajectory_codec  # Shared, copy to folder
+
+class ReplayStore:
+    # Bounded on-disk history of past games, mixed into every training round so each round
+    # sees more data than the fleet collected since the last one. Each game is kept as one
+    # trajectory_codec container (uncompressed body: the frames are already JPEG) in
+    # game_NNNNNNNN.crt, with its metadata in index.json. Once the store is over max_bytes,
+    # games are evicted oldest-first ('fifo') or lowest-priority-first ('priority', where
+    # priority = |total reward|, so decisive games outlive draws).
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3, eviction='fifo'):
+        if eviction not in ('fifo', 'priority'):
+            raise ValueError(f"Unknown replay eviction policy: {eviction}")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.eviction = eviction
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, 'index.json')
+        self.games = []  # [{id, file, bytes, steps, reward, priority, key}] oldest first
+        self.next_id = 1
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                data = json.load(f)
+            self.games = [g for g in data['games'] if os.path.exists(os.path.join(self.directory, g['file']))]
+            self.next_id = data['next_id']
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            self.games = []
+        logging.info(f"Replay store: {len(self.games)} games, {self.total_steps()} steps, {self.total_bytes() / 1024 ** 2:.1f}MB")
+
+    def _save_index(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'next_id': self.next_id, 'games': self.games}, f)
+        os.replace(tmp, self.index_path)
+
+    def total_bytes(self):
+        return sum(g['bytes'] for g in self.games)
+
+    def total_steps(self):
+        return sum(g['steps'] for g in self.games)
+
+    def add_batch(self, batch_file):
+        # Called after a successful round: the fresh games become history. Idempotent per
+        # game (bot_id + timestamp), so a retried job doesn't store its games twice.
+        with self.lock:
+            known = {g['key'] for g in self.games}
+            added = 0
+            for game in trajectory_codec.iter_batch(batch_file, images_as='bytes'):
+                key = f"{game.get('bot_id')}:{game.get('timestamp')}"
+                trajectory = game.get('trajectory', [])
+                if key in known or not trajectory:
+                    continue
+                blob = trajectory_codec.encode_game(game, compression='none')
+                name = f"game_{self.next_id:08d}.crt"
+                path = os.path.join(self.directory, name)
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(blob)
+                os.replace(path + '.tmp', path)
+                reward = game.get('total_reward', sum(s['reward'] for s in trajectory))
+                self.games.append({'id': self.next_id, 'file': name, 'bytes': len(blob), 'steps': len(trajectory),
+                                   'reward': reward, 'priority': abs(reward), 'key': key})
+                known.add(key)
+                self.next_id += 1
+                added += 1
+            evicted = self._evict()
+            self._save_index()
+        logging.info(f"Replay store: +{added} games, -{evicted} evicted, {len(self.games)} kept")
+        return added
+
+    def _evict(self):
+        total = self.total_bytes()
+        evicted = 0
+        while self.games and total > self.max_bytes:
+            if self.eviction == 'priority':
+                victim = min(self.games, key=lambda g: (g['priority'], g['id']))
+            else:
+                victim = self.games[0]
+            self.games.remove(victim)
+            total -= victim['bytes']
+            try:
+                os.remove(os.path.join(self.directory, victim['file']))
+            except FileNotFoundError:
+                pass
+            evicted += 1
+        return evicted
+
+    def sample(self, n_steps, rng=random):
+        # Whole games (GAE needs complete episodes) until ~n_steps historical steps.
+        # 'priority' stores also sample proportionally to priority; 'fifo' samples uniformly.
+        with self.lock:
+            pool = list(self.games)
+        chosen, steps = [], 0
+        while pool and steps < n_steps:
+            if self.eviction == 'priority':
+                game = rng.choices(pool, weights=[g['priority'] + 1.0 for g in pool])[0]
+            else:
+                game = rng.choice(pool)
+            pool.remove(game)
+            chosen.append(game)
+            steps += game['steps']
+        return chosen
+
+    def write_mixed_batch(self, batch_file, out_file, ratio=0.5, rng=random):
+        # CRB1 batch = every fresh game + sampled history making up ~ratio of all steps
+        fresh_steps = 0
+        with open(out_file, 'wb') as out:
+            out.write(trajectory_codec.BATCH_MAGIC)
+            for game in trajectory_codec.iter_batch(batch_file, images_as='bytes'):
+                blob = trajectory_codec.encode_game(game, compression='none')
+                out.write(trajectory_codec.BATCH_RECORD.pack(trajectory_codec.BATCH_FORMATS['bin'], len(blob)) + blob)
+                fresh_steps += len(game.get('trajectory', []))
+            ratio = min(max(ratio, 0.0), 0.95)
+            history = self.sample(int(fresh_steps * ratio / (1.0 - ratio)), rng) if ratio > 0 else []
+            history_steps = 0
+            for game in history:
+                try:
+                    with open(os.path.join(self.directory, game['file']), 'rb') as f:
+                        blob = f.read()
+                except FileNotFoundError:
+                    continue  # Evicted by a concurrent round
+                out.write(trajectory_codec.BATCH_RECORD.pack(trajectory_codec.BATCH_FORMATS['bin'], len(blob)) + blob)
+                history_steps += game['steps']
+        logging.info(f"Mixed batch: {fresh_steps} fresh + {history_steps} replayed steps ({len(history)} games)")
+        return out_file
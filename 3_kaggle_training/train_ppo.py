@@ -1,50 +1,196 @@
 import torch
 import os
+import time
+import shutil
+import tempfile
+import argparse
 import numpy as np
+import gymnasium as gym
+from gymnasium import spaces
 from stable_baselines3 import PPO
-from stable_baselines3.common.env_util import make_vec_env
-from data_loader import load_batch, preprocess_images
+from data_loader import load_batch_frames, drop_cached_frames, DECODE_SECONDS
+from replay_store import ReplayStore
+from metrics import REGISTRY
+
+STEP_SECONDS = REGISTRY.histogram('clash_train_step_seconds', 'One PPO minibatch update (forward, backward, step)')
+EPOCH_SECONDS = REGISTRY.histogram('clash_train_epoch_seconds', 'One shuffled pass over the batch')
+ROUND_SECONDS = REGISTRY.histogram('clash_train_round_seconds', 'Whole train_on_batch call')
 from model import ClashCNN
 import logging
 
-def train_on_batch(batch_file, model_path='current_model.pth', output_path='new_model.pth'):
-    trajectories = load_batch(batch_file)
-    # Fake env for PPO (image obs, discrete action)
-    def make_env():
-        from gymnasium import spaces
-        return make_vec_env(lambda: DummyEnv(spaces.Box(0, 255, (1,224,128), np.uint8), spaces.Discrete(2305)), n_envs=1)
+OBS_SPACE = spaces.Box(0, 255, (1, 224, 128), np.uint8)
+ACTION_SPACE = spaces.Discrete(2305)
+MASKED_LOGIT = -1e8  # Illegal actions: zero probability, but finite so entropy/gradients stay defined
+
+def compute_gae(rewards, values, dones, gamma=0.99, gae_lambda=0.95):
+    # Returns/advantages over the flat step arrays of all games; dones end a game (no bootstrap)
+    advantages = np.zeros_like(rewards, dtype=np.float32)
+    last_adv = 0.0
+    for t in reversed(range(len(rewards))):
+        not_done = 0.0 if dones[t] else 1.0
+        next_value = values[t + 1] if t + 1 < len(rewards) else 0.0
+        delta = rewards[t] + gamma * next_value * not_done - values[t]
+        last_adv = delta + gamma * gae_lambda * not_done * last_adv
+        advantages[t] = last_adv
+    return advantages, advantages + values
+
+def _obs(frames, idx, device):
+    # uint8 [B, 1, 224, 128]; the SB3 policy normalizes images (/255) itself
+    return torch.from_numpy(np.ascontiguousarray(frames[np.sort(idx)])).unsqueeze(1).to(device)
+
+def _masks(action_masks, actions, idx, device):
+    # bool [B, A] legal actions for sorted rows idx (None: no masks, every action legal).
+    # The logged action always counts as legal, so a stale mask can't give it zero probability
+    if action_masks is None:
+        return None
+    masks = np.unpackbits(action_masks[idx], axis=1, count=ACTION_SPACE.n).astype(bool)
+    masks[np.arange(len(idx)), actions[idx]] = True
+    return torch.from_numpy(masks).to(device)
+
+def evaluate_actions(policy, obs, actions, masks=None):
+    # policy.evaluate_actions with the illegal actions taken out of the distribution, as when the bot sampled
+    if masks is None:
+        return policy.evaluate_actions(obs, actions)
+    features = policy.extract_features(obs)
+    if policy.share_features_extractor:
+        latent_pi, latent_vf = policy.mlp_extractor(features)
+    else:
+        latent_pi = policy.mlp_extractor.forward_actor(features[0])
+        latent_vf = policy.mlp_extractor.forward_critic(features[1])
+    logits = policy.action_net(latent_pi).masked_fill(~masks, MASKED_LOGIT)
+    distribution = torch.distributions.Categorical(logits=logits)
+    return policy.value_net(latent_vf), distribution.log_prob(actions), distribution.entropy()
+
+def evaluate_batch(policy, frames, actions, device, chunk=256, action_masks=None):
+    # Value estimates and log-probs of the logged actions under the current policy
+    # action_masks: FrameBatch.action_masks (packed legal actions per step) or None
+    values = np.zeros(len(actions), dtype=np.float32)
+    log_probs = np.zeros(len(actions), dtype=np.float32)
+    with torch.no_grad():
+        for start in range(0, len(actions), chunk):
+            idx = np.arange(start, min(start + chunk, len(actions)))
+            v, lp, _ = evaluate_actions(policy, _obs(frames, idx, device), torch.as_tensor(actions[idx], device=device),
+                                        _masks(action_masks, actions, idx, device))
+            values[idx] = v.flatten().cpu().numpy()
+            log_probs[idx] = lp.cpu().numpy()
+    return values, log_probs
+
+def train_on_batch(batch_file, model_path='current_model.pth', output_path='new_model.pth',
+                   n_epochs=10, batch_size=64, gamma=0.99, gae_lambda=0.95, clip_range=0.2,
+                   vf_coef=0.5, ent_coef=0.0, max_grad_norm=0.5, replay=None, replay_ratio=0.5, cache_dir='frame_cache'):
+    # replay: optional ReplayStore - the round trains on the fresh games plus sampled history,
+    # and the fresh games join the store once training succeeded
+    # cache_dir: decoded frames (data_loader); a batch's entry is kept for retries and dropped once it trained
+    t_round = time.perf_counter()
+    train_file, train_cache = batch_file, cache_dir
+    if replay is not None:
+        train_file = replay.write_mixed_batch(batch_file, os.path.splitext(batch_file)[0] + '_mixed.bin', replay_ratio)
+        # The mixed file is new every round: its frames go to a scratch cache removed with it
+        os.makedirs(cache_dir, exist_ok=True)
+        train_cache = tempfile.mkdtemp(prefix='mixed_', dir=cache_dir)
+    try:
+        output_path = _train(train_file, model_path, output_path, n_epochs, batch_size, gamma, gae_lambda,
+                             clip_range, vf_coef, ent_coef, max_grad_norm, train_cache)
+        drop_cached_frames(train_file, train_cache)  # The batch is deleted after a successful round
+    finally:
+        if train_file != batch_file:
+            if os.path.exists(train_file):
+                os.remove(train_file)
+            shutil.rmtree(train_cache, ignore_errors=True)
+    if replay is not None:
+        replay.add_batch(batch_file)
+    ROUND_SECONDS.observe(time.perf_counter() - t_round)
+    return output_path
+
+def _train(batch_file, model_path, output_path, n_epochs, batch_size, gamma, gae_lambda, clip_range,
+           vf_coef, ent_coef, max_grad_norm, cache_dir='frame_cache'):
+    batch = load_batch_frames(batch_file, cache_dir)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'  # Kaggle T4
 
     # Custom policy with CNN
     policy_kwargs = {"features_extractor_class": ClashCNN, "features_extractor_kwargs": {"features_dim": 512}}
-    model = PPO("CnnPolicy", make_env(), policy_kwargs=policy_kwargs, learning_rate=3e-4, n_steps=2048, batch_size=64, n_epochs=10, verbose=1)
-    
     # Load old if exists
     if os.path.exists(model_path):
-        model = PPO.load(model_path, env=make_env())
+        model = PPO.load(model_path, env=DummyEnv(OBS_SPACE, ACTION_SPACE), device=device)
         logging.info("Loaded old model for incremental train")
+    else:
+        model = PPO("CnnPolicy", DummyEnv(OBS_SPACE, ACTION_SPACE), policy_kwargs=policy_kwargs, learning_rate=3e-4,
+                    n_steps=2048, batch_size=batch_size, n_epochs=n_epochs, verbose=1, device=device)
+    policy = model.policy
+    n = len(batch)
+    if n == 0:
+        model.save(output_path)
+        return output_path
 
-    # Train on batch (offline replay)
-    for traj in trajectories:
-        obs, acts, rews, dones = traj
-        obs = preprocess_images(obs)
-        # PPO collect rollouts (adapt for offline: use replay buffer or custom learn)
-        model.learn(total_timesteps=len(obs), reset_num_timesteps=False)  # Incremental
-        # Custom: model.policy.predict(obs, actions=acts) for loss, but use SB3 learn for simplicity
+    # Offline PPO on the logged trajectories: every game's last step is terminal
+    actions = batch.actions
+    dones = batch.dones.copy()
+    dones[batch.game_offsets[1:] - 1] = True
+    policy.set_training_mode(False)
+    values, old_log_probs = evaluate_batch(policy, batch.frames, actions, device, action_masks=batch.action_masks)
+    # Behaviour policy log-probs are not logged; the bots played with this model, so the
+    # current policy stands in for it and the clip keeps the update near it.
+    advantages, returns = compute_gae(batch.rewards.astype(np.float32), values, dones, gamma, gae_lambda)
+
+    policy.set_training_mode(True)
+    actions_t = torch.as_tensor(actions, device=device)
+    old_log_probs_t = torch.as_tensor(old_log_probs, device=device)
+    advantages_t = torch.as_tensor(advantages, device=device)
+    returns_t = torch.as_tensor(returns, device=device)
+    for epoch in range(n_epochs):
+        # One shuffled pass over all games per epoch
+        losses = []
+        t_epoch = time.perf_counter()
+        for idx in np.array_split(np.random.permutation(n), max(1, n // batch_size)):
+            t_step = time.perf_counter()
+            idx = np.sort(idx)  # Sequential memmap reads; order inside a minibatch doesn't matter
+            idx_t = torch.as_tensor(idx, device=device)
+            new_values, log_prob, entropy = evaluate_actions(policy, _obs(batch.frames, idx, device), actions_t[idx_t],
+                                                             _masks(batch.action_masks, actions, idx, device))
+            adv = advantages_t[idx_t]
+            adv = (adv - adv.mean()) / (adv.std() + 1e-8) if len(idx) > 1 else adv
+            ratio = torch.exp(log_prob - old_log_probs_t[idx_t])
+            policy_loss = -torch.min(adv * ratio, adv * torch.clamp(ratio, 1 - clip_range, 1 + clip_range)).mean()
+            value_loss = torch.nn.functional.mse_loss(returns_t[idx_t], new_values.flatten())
+            loss = policy_loss + vf_coef * value_loss - ent_coef * entropy.mean()
+            policy.optimizer.zero_grad()
+            loss.backward()
+            torch.nn.utils.clip_grad_norm_(policy.parameters(), max_grad_norm)
+            policy.optimizer.step()
+            losses.append(loss.item())  # .item() syncs the GPU, so the step time is real
+            STEP_SECONDS.observe(time.perf_counter() - t_step)
+        EPOCH_SECONDS.observe(time.perf_counter() - t_epoch)
+        logging.info(f"Epoch {epoch + 1}/{n_epochs}: loss {np.mean(losses):.4f}")
+    model.num_timesteps += n  # Incremental
+    model._n_updates += n_epochs
 
     model.save(output_path)
-    logging.info(f"Trained and saved: {output_path}")
+    logging.info(f"Trained on {n} steps / {len(batch.game_offsets) - 1} games and saved: {output_path} "
+                 f"(step p50 {STEP_SECONDS.quantile(0.5) * 1000:.0f}ms, decode p50 {(DECODE_SECONDS.quantile(0.5) or 0) * 1000:.2f}ms/frame)")
     return output_path
 
-class DummyEnv:  # Placeholder for SB3
+class DummyEnv(gym.Env):  # Spaces only - training never steps it
     def __init__(self, obs_space, act_space):
         self.observation_space = obs_space
         self.action_space = act_space
-        self.reset()
 
-    def reset(self):
+    def reset(self, seed=None, options=None):
         return np.zeros((1,224,128), dtype=np.uint8), {}
 
     def step(self, action):
         return np.zeros((1,224,128), dtype=np.uint8), 0, False, False, {}
 
-# Edge: Small batch - Pad with old data if <64. Torch CUDA if available (Kaggle T4). Save only best (no multiples).
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', required=True)
+    parser.add_argument('--model', default='current_model.pth')
+    parser.add_argument('--output', default='new_model.pth')
+    parser.add_argument('--replay-dir', default=None)
+    parser.add_argument('--replay-max-mb', type=int, default=2048)
+    parser.add_argument('--replay-ratio', type=float, default=0.5)
+    args = parser.parse_args()
+    replay = ReplayStore(args.replay_dir, args.replay_max_mb * 1024 * 1024) if args.replay_dir else None
+    train_on_batch(args.batch, args.model, args.output, replay=replay, replay_ratio=args.replay_ratio)
+
+# Edge: Small batch - Replay store pads it with old games. Torch CUDA if available (Kaggle T4). Save only best (no multiples).